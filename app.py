@@ -8,40 +8,121 @@ For commercial use or inquiries, please contact: robert.fuellemann@gmail.com
 """
 
 import os
+import sys
+import json
+import hashlib
+import asyncio
+import threading
+import contextvars
+import multiprocessing
 import gradio as gr
-import speech_recognition as sr
-from openai import OpenAI
-from googletrans import Translator
 from time import time
-from time import sleep
 from dotenv import load_dotenv
 import yaml
-import tempfile
-from datetime import datetime
-
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.pagesizes import A4
-from reportlab.lib.units import cm
-from reportlab.lib.enums import TA_LEFT
+from collections import deque
+from functools import partial, lru_cache
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 from assets.auxiliary_prompts import analysis_prompt, create_summary_prompt
-from assets.auxiliary_functions import remove_emojis
-from assets.auxiliary_classes import TextToSpeechCloud as TextToSpeech
+from assets.auxiliary_functions import remove_emojis, split_sentences, audio_duration, speech_chunks
+from assets.auxiliary_classes import TextToSpeechCloud as TextToSpeech, TextToSpeechGTTS as FallbackTextToSpeech
+from assets.auxiliary_stt import create_speech_to_text, SpeechNotRecognized
+from assets.auxiliary_dialog import DialogFlow, parse_flow, flow_texts, replace_flow_texts, dialog_stats
+from assets.auxiliary_classes import ScenarioBundle, TextCache, HistoryManager, audio_store, outcome_detector, voice_catalog, audio_cache, audio_chunks_html, audio_pending_html, AUDIO_PRESETS
+from assets.auxiliary_export import render_analysis_pdf, write_atomic, pdf_store, pdf_styles
+from assets.auxiliary_metrics import metrics, span, bind_session, start_metrics_server
+from assets.auxiliary_resilience import CircuitBreaker, resilient_call
+from assets.auxiliary_sessions import Session, create_session_store
+from assets.auxiliary_admission import AdmissionController, PrioritySemaphore, set_priority
+from assets.auxiliary_routing import ModelRouter
 
 GPT_MODEL_CHAT = "gpt-4o"
 GPT_MODEL_ANALYSIS = "gpt-4o" # "gpt-5.1-2025-11-13"
-GPT_MODEL_TRANSLATE = "gpt-3.5-turbo"
+GPT_MODEL_SMALL = os.getenv("GPT_MODEL_SMALL", "gpt-4o-mini")
+
+# Candidate models per route, cheapest and fastest first. A request goes to the first model whose
+# p95 latency (latency_budget, seconds) and share of failed or invalid answers (max_error_rate) on
+# the recent traffic are within the profile; answers that fail validation are escalated to the next
+# model. stage is the concurrency limit and call policy the route uses. MODEL_ROUTING=fixed always
+# uses the last model of a profile.
+MODEL_PROFILES = {
+    "chat": {"stage": "chat", "models": [GPT_MODEL_CHAT], "latency_budget": 6, "max_error_rate": 0.1},
+    "conclusion": {"stage": "analysis", "models": [GPT_MODEL_SMALL, GPT_MODEL_ANALYSIS], "latency_budget": 2, "max_error_rate": 0.1},
+    "summary": {"stage": "analysis", "models": [GPT_MODEL_SMALL, GPT_MODEL_ANALYSIS], "latency_budget": 6, "max_error_rate": 0.1, "max_prompt_tokens": {GPT_MODEL_SMALL: 8000}},
+    "translate": {"stage": "translate", "models": [GPT_MODEL_SMALL, GPT_MODEL_ANALYSIS], "latency_budget": 4, "max_error_rate": 0.1},
+    "translate_batch": {"stage": "translate", "models": [GPT_MODEL_SMALL, GPT_MODEL_ANALYSIS], "latency_budget": 20, "max_error_rate": 0.1},
+}
+if os.getenv("MODEL_ROUTING", "adaptive") == "fixed":
+    MODEL_PROFILES = {route: {**profile, "models": profile["models"][-1:]} for route, profile in MODEL_PROFILES.items()}
 
 MAX_TOKEN_CHAT = 100
 MAX_TOKEN_ANALYSIS = 200
+MAX_TOKEN_TRANSLATE_BATCH = 4096
+
+# Token budget of the history sent to the chat model; older turns are folded into a fact sheet
+CHAT_TOKEN_BUDGET = 2500
+
+# Answer unambiguous replies to scripted closed questions (yes/no, fixed choices) without the LLM
+DIALOG_FAST_PATH = True
+
+# Transcript translation for the analysis: one structured request for all messages, or
+# concurrent requests per message (also the fallback when the batch answer is unusable)
+TRANSLATE_BATCH = True
+TRANSLATE_FANOUT_LIMIT = 8
+
+# Stream the reply sentence by sentence (text and audio). False falls back to the blocking main()
+STREAM_CHAT = True
+
+# Concurrency limits per pipeline stage (simultaneous calls in this process)
+STAGE_LIMITS = {"chat": 64, "analysis": 32, "translate": 32, "tts": 32, "stt": 16, "pdf": 4, "session": 16}
+# Timeout per attempt, retries (jittered exponential backoff), hedge delay for idempotent calls
+# and overall deadline per stage, in seconds
+CALL_POLICIES = {
+    "chat": {"timeout": 20, "retries": 1, "deadline": 30},
+    "analysis": {"timeout": 10, "retries": 1, "hedge_after": 4, "deadline": 15},
+    "translate": {"timeout": 30, "retries": 2, "hedge_after": 10, "deadline": 60},
+    "tts": {"timeout": 10, "retries": 1, "hedge_after": 2.5, "deadline": 15},
+    "stt": {"timeout": 20, "retries": 1, "deadline": 30},
+}
+# Concurrency limits per Gradio event (simultaneous handlers in this process)
+EVENT_LIMITS = {"setup": 32, "turn": 64, "stt": 16, "export": 8, "default": 64}
+# Sessions with a running conversation; new sessions beyond it wait in a queue (per process)
+MAX_ACTIVE_SESSIONS = int(os.getenv("MAX_ACTIVE_SESSIONS", "200"))
+SESSION_IDLE_TIMEOUT = int(os.getenv("SESSION_IDLE_TIMEOUT", "600"))  # seconds until an idle session gives up its place
 
 LOGO_PATH = "./assets/logo_stgallen.png"
+BUNDLE_DIR = "./scenario_bundle"
+BUNDLE_INTRO_AUDIO = os.getenv("BUNDLE_INTRO_AUDIO", "0") == "1"  # also store the intro audio (pins one voice per language)
+AUDIO_DELIVERY = os.getenv("AUDIO_DELIVERY", "url")  # "url": served from the audio store, "inline": base64 in the HTML
+# TTS output presets in order of preference, the first one the browser can play is used (see
+# AUDIO_PRESETS). Languages can have their own list, e.g. {"arabic": ["opus", "mp3"]} to keep
+# the full sample rate for a voice that loses intelligibility at 16 kHz. The preset reaches the
+# browser with the HTML players (intro, main()); the reply chunks of main_stream() go through the
+# streaming gr.Audio, which re-encodes every chunk to AAC (ADTS) with ffmpeg, so there the preset
+# only sets the size of the TTS response and the input of that conversion.
+AUDIO_PRESET_PREFERENCE = os.getenv("AUDIO_PRESETS", "opus_low,mp3_low").split(",")
+AUDIO_PRESET_BY_LANGUAGE = {}
+# Reports the formats the browser can play into a hidden textbox when the page loads
+AUDIO_FORMATS_JS = """() => {
+    const audio = document.createElement("audio");
+    const types = {ogg: 'audio/ogg; codecs="opus"', mp3: "audio/mpeg"};
+    return Object.keys(types).filter(format => audio.canPlayType(types[format]) !== "").join(",");
+}"""
+PDF_PROCESSES = int(os.getenv("PDF_PROCESSES", "0"))  # > 0: PDFs are rendered in that many worker processes
+# Gradio copies returned files (the PDF download) into its own cache and writes the streamed audio
+# there as well; (every, older than) in seconds, bounded like the PDF export and audio stores
+GRADIO_CACHE_DELETE = (300, 3600)
+
+# Heavy SDKs (openai, googletrans, Google TTS, reportlab, STT engines) are imported on first use.
+# "background": warm up in a thread after launch, "blocking": before launch, "off": on first use only
+WARM_UP = os.getenv("WARM_UP", "background")
 
 # --------
 # Loading Scenarios
-with open("prompts.yaml", "r", encoding="utf-8") as file:
-    scenarios = yaml.safe_load(file)
+with open("prompts.yaml", "rb") as file:
+    prompts_raw = file.read()
+scenarios = yaml.safe_load(prompts_raw.decode("utf-8"))
+scenario_bundle = ScenarioBundle(BUNDLE_DIR, hashlib.sha256(prompts_raw).hexdigest())
 
 # Dictionary with all languages
 language_dict = { 
@@ -58,58 +139,388 @@ language_dict = {
 }
 
 #---- init ---- 
-translator = Translator()
 load_dotenv()
-api_key = os.getenv("OPENAI_API_KEY")
-client = OpenAI(api_key=api_key) 
+
+# Blocking SDK calls (STT, TTS, googletrans, reportlab) run in this pool, bounded per stage. Waiting
+# calls get the stage by the priority of their event: turns first, the setup of new sessions last.
+stage_semaphores = {stage: PrioritySemaphore(limit) for stage, limit in STAGE_LIMITS.items()}
+blocking_pool = ThreadPoolExecutor(max_workers=STAGE_LIMITS["tts"] + STAGE_LIMITS["stt"] + STAGE_LIMITS["translate"] + STAGE_LIMITS["pdf"] + STAGE_LIMITS["session"])
+translation_cache = TextCache(max_entries=20000)
+analysis_cache = TextCache(max_entries=1000)  # prepared summary and translations by transcript key
+history_manager = HistoryManager(token_budget=CHAT_TOKEN_BUDGET)
+analysis_tasks = {}  # running analysis per session
+background_audio = set()  # synthesis of audio chunks the player loads later and store cleanups, see create_audio()
+session_locks = {}  # serializes the turns per session, see session_lock()
+bundle_builds = {}  # running builds of scenario bundle entries, see bundle_entry_build()
+admission = AdmissionController(max_active=MAX_ACTIVE_SESSIONS, idle_timeout=SESSION_IDLE_TIMEOUT)
+# Conversation state by session hash (SESSION_STORE: memory, sqlite:///path or redis://host:port/db)
+session_store = create_session_store()
+# One circuit per upstream: a failing service is skipped (or replaced by the fallback) for a while
+breakers = {name: CircuitBreaker(name) for name in ("openai", "tts", "gtts", "stt")}
+# Model per LLM request by the profiles and the observed latency, tokens and errors
+model_router = ModelRouter(MODEL_PROFILES)
+
+# Existing counters are exported as gauges next to the span metrics
+metrics.register_collector("audio_cache", audio_cache.stats)
+metrics.register_collector("translation_cache", translation_cache.stats)
+metrics.register_collector("analysis_cache", analysis_cache.stats)
+metrics.register_collector("pdf_export", pdf_store.stats)
+metrics.register_collector("dialog", dialog_stats.stats)
+metrics.register_collector("outcome_detector", outcome_detector.stats)
+metrics.register_collector("stt", lambda: get_speech_to_text().stats() if get_speech_to_text.cache_info().currsize else {})  # never loads a model
+metrics.register_collector("sessions", lambda: {"running_analyses": len(analysis_tasks)})
+metrics.register_collector("session_store", session_store.stats)
+metrics.register_collector("admission", admission.stats)
+metrics.register_collector("model_routing", model_router.stats)
+metrics.register_collector("stage_queue", lambda: {stage: semaphore.waiting() for stage, semaphore in stage_semaphores.items()})
+for breaker in breakers.values():
+    metrics.register_collector(f"circuit_{breaker.name}", breaker.stats)
 # --------
 
-def audio2text(file_path, language):
-    start = time()
-    r = sr.Recognizer()
+@lru_cache(maxsize=None)
+def get_client():
+    # One shared connection pool for all sessions
+    from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+    import httpx
+    limits = httpx.Limits(max_connections=STAGE_LIMITS["chat"] + STAGE_LIMITS["analysis"] + STAGE_LIMITS["translate"], max_keepalive_connections=32)
+    # Retries are done by resilient_call(), not by the SDK
+    return AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0, http_client=DefaultAsyncHttpxClient(limits=limits))
+
+@lru_cache(maxsize=None)
+def get_translator():
+    from googletrans import Translator
+    return Translator()
+
+@lru_cache(maxsize=None)
+def get_speech_to_text():
+    return create_speech_to_text()  # STT_BACKEND=google (default) or whisper (local, CPU)
+
+@lru_cache(maxsize=None)
+def get_pdf_process_pool():
+    # reportlab holds the GIL while rendering, worker processes render documents in parallel.
+    # spawn, because forking a process with running threads can deadlock the child.
+    return ProcessPoolExecutor(max_workers=PDF_PROCESSES, mp_context=multiprocessing.get_context("spawn"))
+
+async def run_blocking(stage, fn, *args, **kwargs):
+    # Runs a blocking call in the worker pool without holding the event loop. The context is
+    # copied, so spans in the worker thread belong to the calling session.
+    queued = time()
+    async with stage_semaphores[stage]:
+        metrics.observe("queue_wait_seconds", time() - queued, stage=stage)
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(blocking_pool, partial(context.run, fn, *args, **kwargs))
+
+def record_usage(route, model, usage, attributes):
+    if usage is None:
+        return
+    stage = MODEL_PROFILES[route]["stage"]
+    attributes.update(prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens)
+    metrics.inc("openai_tokens_total", usage.prompt_tokens, stage=stage, route=route, model=model, kind="prompt")
+    metrics.inc("openai_tokens_total", usage.completion_tokens, stage=stage, route=route, model=model, kind="completion")
+
+async def chat_completion(route, **kwargs):
+    stage = MODEL_PROFILES[route]["stage"]
+    policy = CALL_POLICIES[stage]
+
+    async def attempt():
+        queued = time()
+        async with stage_semaphores[stage]:
+            metrics.observe("queue_wait_seconds", time() - queued, stage=stage)
+            with span(f"openai.{stage}", route=route, model=kwargs["model"]) as attributes:
+                started = time()
+                completion = await get_client().chat.completions.create(timeout=policy["timeout"], **kwargs)
+                usage = getattr(completion, "usage", None)
+                record_usage(route, kwargs["model"], usage, attributes)
+                model_router.observe_call(route, kwargs["model"], time() - started, usage)
+            return completion
+
+    return await resilient_call(stage, attempt, breaker=breakers["openai"], **policy)
+
+async def routed_completion(route, validate=None, **kwargs):
+    # Completion from the model the router chooses for the route. If the call fails or the answer
+    # does not pass validate(completion), the next model of the profile is asked; the last
+    # model's answer is returned as it is (or its error raised), the callers handle that as before.
+    prompt_tokens = history_manager.estimate_tokens(kwargs["messages"])
+    model = model_router.choose(route, prompt_tokens)
+    while True:
+        try:
+            completion = await chat_completion(route, model=model, **kwargs)
+        except Exception:
+            model_router.record_outcome(route, model, "error")
+            model = model_router.escalate(route, model, prompt_tokens, reason="error")
+            if model is None:
+                raise
+            continue
+        valid = validate is None or validate(completion)
+        model_router.record_outcome(route, model, "ok" if valid else "invalid")
+        next_model = model_router.escalate(route, model, prompt_tokens) if not valid else None
+        if next_model is None:
+            return completion
+        model = next_model
+
+def completion_text(completion):
+    return (completion.choices[0].message.content or "").strip()
+
+def answered(completion):
+    # Not empty and not cut off by the token limit
+    return bool(completion_text(completion)) and getattr(completion.choices[0], "finish_reason", None) != "length"
+
+async def synthesize_speech(tts_instance, text):
+    # Audio bytes of the text. Cloud TTS runs with deadline, retry and hedging; if it fails or its
+    # circuit is open, the text is spoken by gTTS instead.
     try:
-        # Use the context manager to ensure the file gets closed after processing
-        with sr.AudioFile(file_path) as source:
-            audio = r.record(source) # read the entire audio file
-
-        rec_text = r.recognize_google(audio, language=language)
-        end = time()
-        print(f"Time audio2text: {end-start}")
-        return rec_text
+        # gTTS has its own circuit, a Cloud TTS outage must not short-circuit the fallback
+        breaker = breakers["gtts" if isinstance(tts_instance, FallbackTextToSpeech) else "tts"]
+        return await resilient_call("tts", lambda: run_blocking("tts", tts_instance.synthesize, text), breaker=breaker, **CALL_POLICIES["tts"])
     except Exception as e:
-        print(f"Unexpected error in audio2text: {e}")
-        return " "
+        if isinstance(tts_instance, FallbackTextToSpeech):
+            raise
+        print(f"Falling back to gTTS: {e!r}")
+        metrics.inc("fallback_total", stage="tts", to="gtts")
+        fallback = FallbackTextToSpeech(language_dict, tts_instance.target_language, session_id=tts_instance.session_id, preset=tts_instance.preset)
+        return await run_blocking("tts", fallback.synthesize, text)
+
+async def create_audio(tts_instance, text):
+    # Audio player and duration of the spoken text. The sentences are synthesized in parallel and
+    # delivered as chunks that play one after the other. With URL delivery the player is returned
+    # as soon as the first chunk is ready: the others are written to the audio store when they are
+    # done and loaded from there by the player, their duration is estimated from their length.
+    # Inline (base64) delivery has to wait for all chunks.
+    if tts_instance.session_id is not None and audio_store.cleanup_due():
+        cleanup = asyncio.create_task(clean_audio_store())
+        background_audio.add(cleanup)
+        cleanup.add_done_callback(background_audio.discard)
+    texts = speech_chunks(text)
+    jobs = [asyncio.create_task(synthesize_speech(tts_instance, chunk)) for chunk in texts]
+    if tts_instance.session_id is None or len(jobs) == 1:
+        chunks = await asyncio.gather(*jobs)
+        return audio_chunks_html(chunks, tts_instance.session_id), sum(audio_duration(chunk) for chunk in chunks)
+
+    try:
+        first_chunk = await jobs[0]
+    except BaseException:
+        for job in jobs[1:]:
+            job.cancel()
+        raise
+    # Suffix of the preset; a gTTS fallback without ffmpeg delivers mp3, which browsers detect anyway
+    suffix = f".{AUDIO_PRESETS[tts_instance.preset]['format']}"
+    pending_paths = [audio_store.reserve(tts_instance.session_id, suffix) for _ in jobs[1:]]
+    for job, path in zip(jobs[1:], pending_paths):
+        background_audio.add(job)
+        job.add_done_callback(partial(store_pending_audio, path))
+    first_duration = audio_duration(first_chunk)
+    duration = first_duration * sum(len(chunk) for chunk in texts) / max(len(texts[0]), 1)
+    return audio_pending_html(first_chunk, pending_paths, tts_instance.session_id), duration
+
+async def clean_audio_store():
+    # Removes the expired audio files in the worker pool, the walk over all sessions is blocking I/O
+    try:
+        await run_blocking("session", audio_store.cleanup)
+    except Exception as e:
+        print(f"Audio store cleanup failed: {e!r}")
+
+def store_pending_audio(path, job):
+    background_audio.discard(job)
+    if job.cancelled():
+        return
+    if job.exception() is not None:
+        print(f"Audio chunk failed: {job.exception()!r}")
+        return
+    audio_store.write(path, job.result())
+
+def audio_presets_of(target_language):
+    # Presets a session in the language can get, the mp3 fallback included
+    preference = AUDIO_PRESET_BY_LANGUAGE.get(target_language, AUDIO_PRESET_PREFERENCE)
+    return [preset for preset in dict.fromkeys(preference + ["mp3"]) if preset in AUDIO_PRESETS]
+
+def choose_audio_preset(audio_formats, target_language):
+    # First preferred preset whose format the browser reported as playable; mp3 plays everywhere
+    playable = set((audio_formats or "").split(","))
+    for preset in audio_presets_of(target_language):
+        if AUDIO_PRESETS[preset]["format"] in playable:
+            return preset
+    return "mp3"
+
+async def create_text_to_speech(target_language, voice_name=None, session_id=None, **audio_config):
+    # Cloud TTS needs the voice list; without it the session starts with gTTS
+    try:
+        return await resilient_call("tts", lambda: run_blocking("tts", TextToSpeech, language_dict, target_language, voice_name=voice_name, session_id=session_id, **audio_config), breaker=breakers["tts"], timeout=CALL_POLICIES["tts"]["timeout"], retries=1)
+    except Exception as e:
+        print(f"Falling back to gTTS: {e!r}")
+        metrics.inc("fallback_total", stage="tts", to="gtts")
+        return FallbackTextToSpeech(language_dict, target_language, session_id=session_id, **audio_config)
+
+def session_lock(session_id):
+    # Turns of one session change its history one after the other: each loads the session, adds
+    # its messages and stores it, overlapping turns would overwrite each other. The lock is held
+    # until the reply is stored, the audio and the analysis of a turn run outside of it. Per
+    # process; a session's events are served by the worker that holds its connection.
+    if session_id not in session_locks:
+        session_locks[session_id] = asyncio.Lock()
+    return session_locks[session_id]
+
+async def session_store_call(fn, *args):
+    # SQLite and Redis block on I/O and run in the worker pool, the memory store is called directly
+    if session_store.name == "memory":
+        return fn(*args)
+    return await run_blocking("session", fn, *args)
+
+async def load_session(request):
+    session = await session_store_call(session_store.get, request.session_hash)
+    if session is None:
+        raise gr.Error("Your session has expired. Please reload the page and start again.")
+    return session
+
+async def save_session(session):
+    await session_store_call(session_store.put, session)
+
+async def session_tts(session):
+    # The speaker of the session, created again from its stored settings in whichever worker
+    # serves the turn; the gRPC clients and the voice catalog are shared by the process
+    if session.tts is None:
+        return None
+    settings = dict(session.tts)
+    engine = settings.pop("engine")
+    session_id = session.session_id if AUDIO_DELIVERY == "url" else None
+    if engine == FallbackTextToSpeech.engine:
+        return FallbackTextToSpeech(language_dict, session.target_language, session_id=session_id, **settings)
+    return await create_text_to_speech(session.target_language, session_id=session_id, **settings)
+
+def audio2text(file_path, language):
+    # Mono, 16 kHz and without leading/trailing silence before it is recognized
+    return get_speech_to_text().transcribe_file(file_path, language)
         
 
-def text2bot(messages, max_length):
-    start = time()
-    completion = client.chat.completions.create(model=GPT_MODEL_CHAT, messages=messages, max_completion_tokens=max_length)
+def api_messages(messages):
+    # Only role and content are sent, msg_history also tags the path that answered a turn
+    return [{"role": msg["role"], "content": msg["content"]} for msg in messages]
+
+
+async def text2bot(messages, max_length):
+    completion = await routed_completion("chat", messages=api_messages(messages), max_completion_tokens=max_length)
     answere = completion.choices[0].message.content
-    end = time()
-    print(f"Time text2bot: {end-start}")
     return answere
 
 
-def gpt_translate(text, text_language, target_language):
+async def text2bot_stream(messages, max_length):
+    # Yields the reply token by token as it is generated
+    # Routed like text2bot(), but without escalation: the reply is already on its way to the user
+    messages = api_messages(messages)
+    model = model_router.choose("chat", history_manager.estimate_tokens(messages))
+    start = time()
+    async with stage_semaphores["chat"]:
+        metrics.observe("queue_wait_seconds", time() - start, stage="chat")
+        with span("openai.chat", route="chat", model=model, stream=True) as attributes:
+            started = time()
+            usage = None
+            try:
+                # Deadline and retries cover the request until the stream starts
+                stream = await resilient_call("chat", lambda: get_client().chat.completions.create(
+                    model=model, messages=messages, max_completion_tokens=max_length, stream=True, stream_options={"include_usage": True}, timeout=CALL_POLICIES["chat"]["timeout"]
+                ), breaker=breakers["openai"], **CALL_POLICIES["chat"])
+                async for chunk in stream:
+                    usage = getattr(chunk, "usage", None) or usage
+                    record_usage("chat", model, getattr(chunk, "usage", None), attributes)
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        if "first_token_s" not in attributes:
+                            attributes["first_token_s"] = round(time() - start, 3)
+                        yield chunk.choices[0].delta.content
+            except Exception:
+                model_router.record_outcome("chat", model, "error")
+                raise
+            model_router.observe_call("chat", model, time() - started, usage)
+            model_router.record_outcome("chat", model, "ok")
+
+
+async def gpt_translate(text, text_language, target_language):
     messages = [
         {"role": "system", "content": "You are a translation assistant. Always respond with only the translated text."},
         {"role": "user", "content": f"Translate the following text from {text_language} to {target_language}. Only return the translated text, without any additional information:\n\n{text}"}
     ]
 
-    completion = client.chat.completions.create(
-        model=GPT_MODEL_TRANSLATE,
+    completion = await routed_completion(
+        "translate",
+        validate=answered,
         messages=messages,
         max_tokens=MAX_TOKEN_ANALYSIS,
         temperature=0
     )
 
-    return completion.choices[0].message.content.strip()
+    return completion_text(completion)
+
+
+async def gpt_translate_batch(texts, text_language, target_language):
+    # Translates all texts in one structured request. Returns None if the answer does not
+    # contain exactly one translation per text.
+    messages = [
+        {"role": "system", "content": (
+            "You are a translation assistant. You receive a JSON object with a list of messages. "
+            'Respond with a JSON object {"translations": [...]} that contains exactly one translated text '
+            "per message, in the same order, without any additional information."
+        )},
+        {"role": "user", "content": json.dumps({"from": text_language, "to": target_language, "messages": texts}, ensure_ascii=False)}
+    ]
+
+    def parse(completion):
+        try:
+            translations = json.loads(completion.choices[0].message.content)["translations"]
+        except (json.JSONDecodeError, KeyError, TypeError) as e:
+            print(f"Unexpected answer in gpt_translate_batch: {e}")
+            return None
+        if not isinstance(translations, list) or len(translations) != len(texts) or not all(isinstance(t, str) for t in translations):
+            print("Unexpected answer in gpt_translate_batch: number of translations does not match")
+            return None
+        return [t.strip() for t in translations]
+
+    completion = await routed_completion(
+        "translate_batch",
+        validate=lambda completion: parse(completion) is not None,
+        messages=messages,
+        max_tokens=min(MAX_TOKEN_ANALYSIS * len(texts), MAX_TOKEN_TRANSLATE_BATCH),
+        temperature=0,
+        response_format={"type": "json_object"}
+    )
+    return parse(completion)
+
+
+async def translate_transcript(texts, text_language, target_language):
+    # Translates a list of messages. Messages translated before (e.g. in an earlier export of the
+    # same conversation) come from the cache, the rest is translated in one batch or concurrently.
+    keys = [TextCache.make_key(text_language, target_language, text) for text in texts]
+    translations = [translation_cache.get(key) for key in keys]
+    for i, text in enumerate(texts):
+        if not text.strip():
+            translations[i] = text
+    missing = [i for i, translation in enumerate(translations) if translation is None]
+    if not missing:
+        return translations
+
+    with span("translate.transcript", messages=len(texts), cached=len(texts) - len(missing)) as attributes:
+        results = None
+        if TRANSLATE_BATCH and len(missing) > 1:
+            attributes["mode"] = "batch"
+            results = await gpt_translate_batch([texts[i] for i in missing], text_language, target_language)
+
+        if results is None:
+            attributes["mode"] = "fanout"
+            fanout = asyncio.Semaphore(TRANSLATE_FANOUT_LIMIT)
+
+            async def translate_one(text):
+                async with fanout:
+                    return await gpt_translate(text, text_language, target_language)
+
+            results = await asyncio.gather(*[translate_one(texts[i]) for i in missing])
+
+    for i, translation in zip(missing, results):
+        translations[i] = translation
+        translation_cache.put(keys[i], translation)
+    return translations
 
 
 # --------
 
 
-def initialize_scenario(selected_scenario, target_language, msg_history):
+async def initialize_scenario(selected_scenario, target_language, msg_history):
 
     context_text = scenarios[selected_scenario]["context"]
     role_text = scenarios[selected_scenario]["role"]
@@ -119,73 +530,352 @@ def initialize_scenario(selected_scenario, target_language, msg_history):
         {"role": "system", "content": role_text},
         ]
     
-    msg_history[0]["content"] = translator.translate(msg_history[0]["content"], dest=language_dict[target_language][0]).text
+    with span("googletrans", characters=len(msg_history[0]["content"])):
+        translation = await run_blocking("translate", get_translator().translate, msg_history[0]["content"], dest=language_dict[target_language][0])
+    msg_history[0]["content"] = translation.text
 
     if context_text and target_language != "german":
-        context_text = gpt_translate(context_text, "german", target_language)
+        context_text = await gpt_translate(context_text, "german", target_language)
 
     return msg_history, context_text
 
-def conv_preview_recording(file_path, target_language):
-    if file_path is not None:
-        rec_text = audio2text(file_path, language_dict[target_language][1])
-    else:
-        rec_text = ""
-    return rec_text
-
-def main(preview_text, msg_history, tts_instance):
-    # Main function for the chatbot. It takes the preview text and the message history and 
-    # returns the chat history, the audio player and the message history
-    
-    # Converting the audio message to text
-    message = preview_text
-    msg_history.append({"role": "user", "content":message})
-
-    # Generating a response from the bot using the conversation history
-    respons = text2bot(msg_history, max_length=MAX_TOKEN_CHAT)
-    msg_history.append({"role": "assistant", "content":respons})
-
-    # Converting bot's text response to audio speech
-    audio_player = None
-    if tts_instance is not None:
-        audio_player, _ = tts_instance.create_audio(respons)
-    else:
-        print("Warning: TextToSpeech instance not initialized before calling main().")
+async def build_bundle_entry(selected_scenario, target_language, with_audio=BUNDLE_INTRO_AUDIO):
+    # Translates one scenario into one language and stores it in the scenario bundle
+    init_msg_history, context_text = await initialize_scenario(selected_scenario, target_language, [])
+    entry = {"role": init_msg_history[0]["content"], "context": context_text, "voice": None}
+
+    # Outcome markers and fact keywords in the target language for the local checks
+    outcomes = scenarios[selected_scenario].get("outcomes") or []
+    facts = scenarios[selected_scenario].get("facts") or {}
+    dialog_steps = parse_flow(scenarios[selected_scenario]["role"] or "")
+    complete = True
+    if target_language != "german":
+        # Best effort: a failed translation leaves its part out, so that check falls back to the
+        # LLM, and the entry is rebuilt by the next background build
+        outcomes, fact_keywords, dialog_texts = await asyncio.gather(
+            translate_transcript(outcomes, "german", target_language),
+            translate_transcript(list(facts.values()), "german", target_language),
+            translate_transcript(flow_texts(dialog_steps), "german", target_language),
+            return_exceptions=True,
+        )
+        for name, result in (("outcomes", outcomes), ("facts", fact_keywords), ("dialog", dialog_texts)):
+            if isinstance(result, Exception):
+                print(f"Translation of the {name} of {selected_scenario} / {target_language} failed: {result!r}")
+                complete = False
+        outcomes = [] if isinstance(outcomes, Exception) else outcomes
+        facts = {} if isinstance(fact_keywords, Exception) else dict(zip(facts.keys(), fact_keywords))
+        dialog_steps = None if isinstance(dialog_texts, Exception) else replace_flow_texts(dialog_steps, dialog_texts)
+    entry["outcomes"] = outcomes
+    entry["facts"] = facts
+    entry["dialog"] = dialog_steps
+    entry["complete"] = complete
+
+    audio = None
+    if with_audio and context_text:
+        # Chunked like create_audio() does it, in every preset choose_audio_preset() can pick for
+        # the language, with the same voice
+        audio = []
+        chunks = speech_chunks(context_text)
+        for preset in audio_presets_of(target_language):
+            tts_instance = await run_blocking("tts", TextToSpeech, language_dict, target_language, voice_name=entry["voice"], preset=preset)
+            entry["voice"] = tts_instance.voice_name
+            audio += zip(map(tts_instance.cache_key, chunks), await asyncio.gather(*[run_blocking("tts", tts_instance.synthesize, chunk) for chunk in chunks]))
+
+    scenario_bundle.set(selected_scenario, target_language, entry, audio=audio)
+    return entry
+
+def bundle_entry_build(selected_scenario, target_language):
+    # One build per entry at a time: a Start click and the background build of the same entry
+    # share it
+    key = (selected_scenario, target_language)
+    task = bundle_builds.get(key)
+    if task is None:
+        task = asyncio.create_task(build_bundle_entry(selected_scenario, target_language))
+        bundle_builds[key] = task
+        task.add_done_callback(lambda _: bundle_builds.pop(key, None))
+    return task
+
+def missing_bundle_entries():
+    # Scenarios and languages that are not in the bundle yet or were only partly translated
+    return [
+        (selected_scenario, target_language)
+        for selected_scenario in scenarios if selected_scenario != "User Defined Scenario"
+        for target_language in language_dict
+        if not (scenario_bundle.get(selected_scenario, target_language) or {"complete": False}).get("complete", True)
+    ]
 
-    # Creating a list of tuples, each containing a user's message and corresponding bot's response
-    msg_chat = [(msg_history[i]["content"], msg_history[i+1]["content"]) for i in range(1, len(msg_history)-1, 2)]
-    return msg_chat, audio_player, None, None, msg_history
+async def build_scenario_bundle(with_audio=BUNDLE_INTRO_AUDIO):
+    # Build step: precomputes every scenario in every language that is not in the bundle yet
+    for selected_scenario, target_language in missing_bundle_entries():
+        print(f"Building scenario bundle: {selected_scenario} / {target_language}")
+        await build_bundle_entry(selected_scenario, target_language, with_audio=with_audio)
+
+async def build_missing_bundle():
+    # Background warm-up: builds the missing entries one at a time, behind the users' requests
+    set_priority("background")
+    for selected_scenario, target_language in await run_blocking("session", missing_bundle_entries):
+        start = time()
+        try:
+            await asyncio.shield(bundle_entry_build(selected_scenario, target_language))
+        except Exception as e:
+            print(f"Warm-up scenario bundle {selected_scenario} / {target_language} failed: {e!r}")
+        else:
+            print(f"Time warm-up scenario bundle {selected_scenario} / {target_language}: {time()-start:.3f}")
 
-def setup_main(target_language, selected_scenario, def_usr_scenario, msg_history):
-    global scenarios
+async def conv_preview_recording(file_path, target_language, request: gr.Request):
+    set_priority("turn")
+    bind_session(request.session_hash, target_language)
+    if file_path is None:
+        return ""
+    try:
+        return await resilient_call("stt", lambda: run_blocking("stt", audio2text, file_path, language_dict[target_language][1]), breaker=breakers["stt"], give_up_on=(SpeechNotRecognized,), **CALL_POLICIES["stt"])
+    except Exception as e:
+        print(f"Unexpected error in audio2text: {e!r}")
+        return " "
 
-    # Insert the user defined scenario if selected
+def scenario_entry(selected_scenario, target_language):
+    # Bundle entry of the running scenario, None for the user defined scenario
     if selected_scenario == "User Defined Scenario":
-        scenarios["User Defined Scenario"]["role"] = def_usr_scenario
+        return None
+    return scenario_bundle.get(selected_scenario, target_language)
 
-    # Initialize Text to Speech
-    tts_instance = TextToSpeech(language_dict, target_language)
+def scripted_reply(msg_history, entry, target_language):
+    # Next scripted text if the user's last message clearly answers the scripted question before it
+    if not DIALOG_FAST_PATH or not entry or not entry.get("dialog") or len(msg_history) < 3 or msg_history[-2]["role"] != "assistant":
+        return None
+    flow = DialogFlow(entry["dialog"], language_dict[target_language][0])
+    return flow.reply(msg_history[-2]["content"], msg_history[-1]["content"])
 
-    # Initialize the scenario and play the introduction
-    init_msg_history, context_promt = initialize_scenario(selected_scenario, target_language, msg_history)
-    msg_history = init_msg_history.copy()
+async def scripted_tokens(text):
+    yield text
 
-    if context_promt:
-        audio_player, duration = tts_instance.create_audio(context_promt)
-    else:
-        audio_player, duration = None, 0.0
+def format_transcript(messages):
+    return "\n".join([
+        f"{msg['role'].capitalize()}: {msg['content']}"
+        for msg in messages
+    ])
 
-    return audio_player, duration, context_promt, msg_history, tts_instance
+def start_analysis(session_id, chat_history, target_language, selected_scenario):
+    # Starts the conclusion check (and speculative analysis) of a turn. A still running analysis
+    # of the session's previous turn is obsolete and gets cancelled.
+    cancel_analysis(session_id)
+
+    async def run_analysis():
+        try:
+            return await update_analysis_visibility(chat_history, target_language, selected_scenario)
+        except Exception as e:
+            print(f"Unexpected error in analysis: {e}")
+            return gr.update(visible=False)
+        finally:
+            if analysis_tasks.get(session_id) is task:
+                del analysis_tasks[session_id]
+
+    task = asyncio.create_task(run_analysis())
+    analysis_tasks[session_id] = task
+    return task
+
+def cancel_analysis(session_id):
+    task = analysis_tasks.pop(session_id, None)
+    if task is not None:
+        task.cancel()
+
+async def main(preview_text, request: gr.Request):
+    # Main function for the chatbot. It takes the preview text, continues the conversation of the
+    # session and returns the chat history, the audio player and the analysis download
+    set_priority("turn")
+    admission.touch(request.session_hash)
+    cancel_analysis(request.session_hash)
+    with span("turn", stream=False) as turn:
+        async with session_lock(request.session_hash):
+            # Also the analysis a previous turn of the session started while this one waited
+            cancel_analysis(request.session_hash)
+            session = await load_session(request)
+            target_language, selected_scenario, msg_history = session.target_language, session.scenario, session.msg_history
+            bind_session(request.session_hash, target_language)
+            tts_instance = await session_tts(session)
+
+            # Converting the audio message to text
+            message = preview_text
+            msg_history.append({"role": "user", "content":message})
+
+            # Generating a response: scripted if the answer is unambiguous, otherwise by the bot using
+            # the (compacted) conversation history
+            entry = scenario_entry(selected_scenario, target_language)
+            respons = scripted_reply(msg_history, entry, target_language)
+            path = "rules" if respons is not None else "llm"
+            if respons is None:
+                respons = await text2bot(history_manager.compact(msg_history, entry and entry.get("facts")), max_length=MAX_TOKEN_CHAT)
+            msg_history.append({"role": "assistant", "content":respons, "path": path})
+            await save_session(session)
+        dialog_stats.count(path)
+        turn["path"] = path
+
+        # Converting bot's text response to audio speech, concurrently with the analysis
+        analysis_task = start_analysis(request.session_hash, list(msg_history), target_language, selected_scenario)
+        audio_player = None
+        if tts_instance is not None:
+            audio_player, _ = await create_audio(tts_instance, respons)
+        else:
+            print("Warning: TextToSpeech instance not initialized before calling main().")
+
+        await asyncio.wait({analysis_task})
+        analysis_update = gr.skip() if analysis_task.cancelled() else analysis_task.result()
+
+        msg_chat = history2chat(msg_history)
+        return msg_chat, audio_player, None, None, analysis_update
+
+def first_audio(turn, turn_start):
+    # Time from the user's message to the first playable audio chunk of the reply
+    if "first_audio_s" not in turn:
+        turn["first_audio_s"] = round(time() - turn_start, 3)
+        metrics.observe("first_audio_seconds", turn["first_audio_s"])
+
+async def main_stream(preview_text, request: gr.Request):
+    # Streaming variant of main(). The reply is shown while it is generated and every complete
+    # sentence is synthesized in the background, so the audio starts after the first sentence
+    # instead of after the whole reply. Audio chunks are yielded in order to a streaming gr.Audio.
+    # Once the reply is complete, the analysis runs concurrently and is delivered when ready.
+    set_priority("turn")
+    admission.touch(request.session_hash)
+    cancel_analysis(request.session_hash)
+    audio_jobs = deque()
+    with span("turn", stream=True) as turn:
+        try:
+            async with session_lock(request.session_hash):
+                # Also the analysis a previous turn of the session started while this one waited
+                cancel_analysis(request.session_hash)
+                session = await load_session(request)
+                target_language, selected_scenario, msg_history = session.target_language, session.scenario, session.msg_history
+                bind_session(request.session_hash, target_language)
+                message = preview_text
+                # Stored together with the reply, a failed reply leaves the stored history as it was
+                msg_history.append({"role": "user", "content":message})
+                msg_chat = history2chat(msg_history) + [(message, "")]
+                yield msg_chat, gr.skip(), None, None, gr.skip()
+
+                turn_start = time()
+                tts_instance = await session_tts(session)
+                if tts_instance is None:
+                    print("Warning: TextToSpeech instance not initialized before calling main_stream().")
+
+                entry = scenario_entry(selected_scenario, target_language)
+                scripted = scripted_reply(msg_history, entry, target_language)
+                path = "rules" if scripted is not None else "llm"
+                turn["path"] = path
+                if scripted is not None:
+                    reply_tokens = scripted_tokens(scripted)
+                else:
+                    reply_tokens = text2bot_stream(history_manager.compact(msg_history, entry and entry.get("facts")), max_length=MAX_TOKEN_CHAT)
+
+                respons = ""
+                pending = ""
+                async for token in reply_tokens:
+                    respons += token
+                    sentences, pending = split_sentences(pending + token)
+                    if tts_instance is not None:
+                        for sentence in sentences:
+                            audio_jobs.append(asyncio.create_task(synthesize_speech(tts_instance, sentence)))
+                    msg_chat[-1] = (message, respons)
+                    yield msg_chat, gr.skip(), None, None, gr.skip()
+
+                    # Hand over finished chunks without waiting for the ones still in progress
+                    while audio_jobs and audio_jobs[0].done():
+                        first_audio(turn, turn_start)
+                        yield msg_chat, audio_jobs.popleft().result(), None, None, gr.skip()
+
+                msg_history.append({"role": "assistant", "content":respons, "path": path})
+                await save_session(session)
+            dialog_stats.count(path)
+            if tts_instance is not None and pending.strip():
+                audio_jobs.append(asyncio.create_task(synthesize_speech(tts_instance, pending.strip())))
+
+            # Remaining audio and the analysis are delivered in the order they finish; the next
+            # message of the session does not wait for them
+            analysis_task = start_analysis(request.session_hash, list(msg_history), target_language, selected_scenario)
+            while audio_jobs or analysis_task is not None:
+                waiting = {audio_jobs[0]} if audio_jobs else set()
+                if analysis_task is not None:
+                    waiting.add(analysis_task)
+                await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+
+                if analysis_task is not None and analysis_task.done():
+                    if not analysis_task.cancelled():
+                        yield msg_chat, gr.skip(), None, None, analysis_task.result()
+                    analysis_task = None
+                while audio_jobs and audio_jobs[0].done():
+                    first_audio(turn, turn_start)
+                    yield msg_chat, audio_jobs.popleft().result(), None, None, gr.skip()
+        finally:
+            # The event was cancelled (e.g. the user left), do not synthesize the rest
+            for job in audio_jobs:
+                job.cancel()
+
+    yield history2chat(msg_history), gr.skip(), None, None, gr.skip()
+
+def history2chat(msg_history):
+    # Creating a list of tuples, each containing a user's message and corresponding bot's response
+    return [(msg_history[i]["content"], msg_history[i+1]["content"]) for i in range(1, len(msg_history)-1, 2)]
+
+async def wait_for_admission(request: gr.Request):
+    # Runs before setup_main(): shows the queue position while the maximum number of active
+    # sessions is reached
+    async for position in admission.admit(request.session_hash):
+        yield f"⏳ Many people are using the Sozialhilfe-Check right now. Please wait, you are number {position} in the queue."
+    yield gr.skip()
 
-def conversation_concluded(chat_history, max_length=30):
+async def setup_main(target_language, selected_scenario, def_usr_scenario, audio_formats, request: gr.Request):
+    global scenarios
+
+    set_priority("setup")
+    bind_session(request.session_hash, target_language)
+    with span("setup", scenario=selected_scenario) as attributes:
+        # Insert the user defined scenario if selected; only this one is translated live
+        if selected_scenario == "User Defined Scenario":
+            scenarios["User Defined Scenario"]["role"] = def_usr_scenario
+            init_msg_history, context_promt = await initialize_scenario(selected_scenario, target_language, [])
+            voice_name = None
+        else:
+            # Load the precomputed scenario, missing entries are built once and then reused
+            entry = scenario_bundle.get(selected_scenario, target_language)
+            attributes["bundled"] = entry is not None
+            entry = entry or await asyncio.shield(bundle_entry_build(selected_scenario, target_language))
+            init_msg_history = [{"role": "system", "content": entry["role"]}]
+            context_promt = entry["context"]
+            voice_name = entry["voice"]
+
+        # Initialize Text to Speech
+        session_id = request.session_hash if AUDIO_DELIVERY == "url" else None
+        preset = choose_audio_preset(audio_formats, target_language)
+        attributes["audio_preset"] = preset
+        tts_instance = await create_text_to_speech(target_language, voice_name=voice_name, session_id=session_id, preset=preset)
+
+        session = Session(request.session_hash, target_language, selected_scenario, init_msg_history.copy(), tts_instance.settings())
+        await save_session(session)
+
+        if context_promt:
+            audio_player, duration = await create_audio(tts_instance, context_promt)
+        else:
+            audio_player, duration = None, 0.0
+
+        return audio_player, duration, context_promt
+
+async def conversation_concluded(chat_history, max_length=30, outcome_markers=None, facts=None, fallback=True):
     """Return True when the Sozialhilfe dialog already reached its final result."""
     if len(chat_history) <= 2:
         return False
 
-    chat_text = "\n".join([
-        f"{msg['role'].capitalize()}: {msg['content']}"
-        for msg in chat_history[2:]
-    ])
+    # Clear cases are decided locally, only ambiguous ones are sent to the LLM
+    verdict = outcome_detector.detect(chat_history, outcome_markers)
+    if verdict is not None:
+        return verdict
+    return await llm_conclusion(chat_history, max_length=max_length, facts=facts, fallback=fallback)
+
+async def llm_conclusion(chat_history, max_length=30, facts=None, fallback=True):
+    # fallback=False raises instead of answering "not concluded" when there is no verdict, for
+    # callers that keep the decision (batch mode)
+    # Older turns are reduced to the fact sheet, the outcome is in the recent ones
+    compacted_history = history_manager.compact(chat_history, facts)
+    chat_text = format_transcript(compacted_history[2:] if compacted_history is chat_history else compacted_history[1:])
 
     messages_analysis = [
         {
@@ -195,19 +885,74 @@ def conversation_concluded(chat_history, max_length=30):
         {"role": "user", "content": chat_text},
     ]
 
-    completion = client.chat.completions.create(
-        model=GPT_MODEL_ANALYSIS,
-        messages=messages_analysis,
-        max_completion_tokens=max_length,
-        temperature=0
-    )
+    try:
+        # An answer that is neither TRUE nor FALSE is asked again from the larger model
+        completion = await routed_completion(
+            "conclusion",
+            validate=lambda completion: completion_text(completion).lower().startswith(("true", "false")),
+            messages=messages_analysis,
+            max_completion_tokens=max_length,
+            temperature=0
+        )
+    except Exception as e:
+        if not fallback:
+            raise
+        # Without a verdict the conversation simply goes on; it is checked again after the next turn
+        print(f"Conclusion check failed: {e!r}")
+        metrics.inc("fallback_total", stage="analysis", to="not_concluded")
+        return False
 
-    answer = completion.choices[0].message.content.strip().lower()
+    answer = completion_text(completion).lower()
+    if not fallback and not answer.startswith(("true", "false")):
+        raise ValueError(f"Unexpected answer of the conclusion check: {answer[:50]!r}")
     return answer.startswith("true")
 
 
-def delay(seconds):
-    sleep(seconds)
+def warm_up():
+    # Pays the first-use costs before the first user does: scenario bundle (with the intro
+    # audio), heavy imports, the TTS channel with the voice list and the STT model
+    steps = [
+        ("scenario bundle", scenario_bundle.ensure_loaded),
+        ("openai", get_client),
+        ("translator", get_translator),
+        ("speech to text", get_speech_to_text),
+        ("pdf styles", pdf_styles),
+        ("tokenizer", history_manager.get_encoding),
+    ]
+    if os.getenv("GOOGLE_CREDENTIALS"):
+        steps.append(("tts voices", lambda: voice_catalog.voices(language_dict["german"][1])))
+    for name, step in steps:
+        start = time()
+        try:
+            step()
+        except Exception as e:
+            print(f"Warm-up {name} failed: {e}")
+        else:
+            print(f"Time warm-up {name}: {time()-start:.3f}")
+
+connections_warmed = False
+bundle_warm_up = None  # task of build_missing_bundle(), kept so that it is not garbage collected
+
+async def warm_up_connections():
+    # The OpenAI connection pool belongs to the server's event loop, so it is opened there on the
+    # first page load, while the user is still on the setup tab
+    global connections_warmed, bundle_warm_up
+    if connections_warmed:
+        return
+    connections_warmed = True
+    start = time()
+    try:
+        await get_client().models.list()
+        print(f"Time warm-up openai connection: {time()-start:.3f}")
+    except Exception as e:
+        print(f"Warm-up openai connection failed: {e}")
+    # The missing scenario bundle entries need the same loop; built in the background so that the
+    # first Start click per language finds its entry ready
+    bundle_warm_up = asyncio.create_task(build_missing_bundle())
+
+async def delay(seconds):
+    # Waits for the intro audio without holding a worker thread
+    await asyncio.sleep(seconds)
     return None
 
 def toggle_start_button(target_lang, scenario):
@@ -222,29 +967,8 @@ def toggle_user_scenario_interface(scenario):
         return [gr.update(visible=True), gr.update(visible=True)]
     return [gr.update(visible=False), gr.update(visible=False)]
 
-def add_header_and_page_number(canvas, doc):
-    canvas.saveState()
-    
-    # Page number (bottom center)
-    page_num = canvas.getPageNumber()
-    canvas.setFont("Helvetica", 9)
-    canvas.drawCentredString(A4[0] / 2, 1 * cm, f"Seite {page_num}")
-    
-    # Header logo (top left)
-    if hasattr(doc, "logo_path") and doc.logo_path and os.path.exists(doc.logo_path):
-        canvas.drawImage( doc.logo_path, 1 * cm, A4[1] - 3 * cm, width=3 * cm, height=3 * cm, preserveAspectRatio=True, mask="auto")
-
-    
-    # Header line
-    canvas.line(1 * cm, A4[1] - 3.2 * cm, A4[0] - 1 * cm, A4[1] - 3.2 * cm)
-
-    canvas.restoreState()
-
-def create_summary(chat_history):
-    chat_text = "\n".join([
-        f"{msg['role'].capitalize()}: {msg['content']}"
-        for msg in chat_history[1:]
-    ])
+async def create_summary(chat_history):
+    chat_text = format_transcript(chat_history[1:])
 
     messages_summary = [
         {
@@ -257,84 +981,82 @@ def create_summary(chat_history):
         },
     ]
 
-    completion = client.chat.completions.create(
-        model=GPT_MODEL_ANALYSIS,
+    completion = await routed_completion(
+        "summary",
+        validate=answered,
         messages=messages_summary,
         max_completion_tokens=200,
         temperature=0.2
     )
 
-    return completion.choices[0].message.content.strip()
+    return completion_text(completion)
 
 
-def create_analysis_file(msg_history, target_language, logo_path=LOGO_PATH):
-    
-    timestamp = datetime.now().strftime("%Y-%m-%d")
-
-    # Create temp PDF
-    _, path = tempfile.mkstemp(suffix=".pdf")
-
-    doc = SimpleDocTemplate(path, pagesize=A4,
-                            topMargin=3.5 * cm, bottomMargin=2 * cm,
-                            leftMargin=2 * cm, rightMargin=2 * cm)
-
-    doc.logo_path = logo_path  # store for canvas callback
-
-    styles = getSampleStyleSheet()
-    user_style = ParagraphStyle(name="UserChat",parent=styles["Normal"],alignment=TA_LEFT,fontSize=10,leading=13,spaceAfter=5,leftIndent=0)
-    assistant_style = ParagraphStyle(name="AssistantChat",parent=styles["Normal"],alignment=TA_LEFT,fontSize=10,leading=13,spaceAfter=5,leftIndent=25)
-    flow = []
-
-    flow.append(Paragraph(f"<b>Exportdatum:</b> {timestamp}", styles['Normal']))
-    flow.append(Spacer(1, 12))
-
-    flow.append(Paragraph("<b>Sozialhilfe-Check St.Gallen</b>", styles['Heading2']))
-    flow.append(Spacer(1, 12))
-
-    flow.append(Paragraph("<b>DEUTSCH</b>", styles['Heading3']))
-    flow.append(Paragraph("<b>Übersicht:</b>"))
-    flow.append(Spacer(1, 8))
-    summary = create_summary(msg_history)
-    for line in summary.split("\n"):
-        if line.strip():
-            flow.append(Paragraph(line.strip(), styles["Normal"]))
-            flow.append(Spacer(1, 4))
-
-    flow.append(Spacer(1, 12))
-    flow.append(Spacer(1, 12))
-    for msg in msg_history[2:]:
-        text = remove_emojis(msg["content"]).replace("\n", "<br/>")
-        if target_language != "german":
-            text = gpt_translate(text, target_language, "german")
-        if msg["role"] == "user":
-            flow.append(Paragraph(f"<b>Beantragende:r:</b> {text}", user_style))
-        else:
-            flow.append(Paragraph(f"<b>Sozi-Bot:</b> {text}", assistant_style))
-    flow.append(Spacer(1, 12))
-    if target_language != 'german':
-        flow.append(Paragraph(f"<b>{target_language.capitalize()}</b>", styles['Heading3']))
-        for msg in msg_history[2:]:
-            text = remove_emojis(msg["content"]).replace("\n", "<br/>")
-            if msg["role"] == "user":
-                flow.append(Paragraph(f"<b>Beantragende:r:</b> {text}", user_style))
-            else:
-                flow.append(Paragraph(f"<b>Sozi-Bot:</b> {text}", assistant_style))
-        flow.append(Spacer(1, 12))
-
-    # Build with custom header/footer for each page
-    doc.build(flow,
-              onFirstPage=add_header_and_page_number,
-              onLaterPages=add_header_and_page_number)
-
-    return path
-
-def update_analysis_visibility(chat_history, target_language):
-    """Return a UI update that toggles the analysis download visibility."""
-    if conversation_concluded(chat_history):
-        path = create_analysis_file(chat_history, target_language, logo_path=LOGO_PATH)
-        return gr.update(value=path, visible=True)
+async def prepare_analysis(msg_history, target_language):
+    # The LLM part of the analysis: summary and German transcript, run in parallel
+    with span("analysis.prepare", messages=len(msg_history) - 2):
+        return await prepare_analysis_texts(msg_history, target_language)
+
+async def prepare_analysis_texts(msg_history, target_language):
+    texts = [remove_emojis(msg["content"]) for msg in msg_history[2:]]
+    if target_language != "german":
+        summary, texts_german = await asyncio.gather(create_summary(msg_history), translate_transcript(texts, target_language, "german"))
     else:
-        return gr.update(visible=False)
+        summary, texts_german = await create_summary(msg_history), texts
+    return summary, texts_german
+
+async def create_analysis_file(msg_history, target_language, logo_path=LOGO_PATH):
+    # Path of the analysis PDF; rendered only if this transcript was not exported before
+    with span("pdf") as attributes:
+        key = pdf_store.make_key(msg_history, target_language)
+        path = pdf_store.get(key)
+        attributes["cached"] = path is not None
+        if path is not None:
+            return path
+
+        prepared = analysis_cache.get(key) or await prepare_analysis(msg_history, target_language)
+        analysis_cache.put(key, prepared)
+        summary, texts_german = prepared
+        render = partial(render_analysis_pdf, msg_history=api_messages(msg_history), target_language=target_language, summary=summary, texts_german=texts_german, logo_path=logo_path)
+        if not PDF_PROCESSES:
+            return await run_blocking("pdf", pdf_store.create, key, render)
+
+        queued = time()
+        async with stage_semaphores["pdf"]:
+            metrics.observe("queue_wait_seconds", time() - queued, stage="pdf")
+            path = await asyncio.get_running_loop().run_in_executor(get_pdf_process_pool(), write_atomic, pdf_store.path(key), render)
+        pdf_store.created()
+        return path
+
+async def export_analysis(request: gr.Request):
+    # The PDF is built when the user asks for it, not when the conversation is concluded
+    set_priority("export")
+    session = await load_session(request)
+    bind_session(request.session_hash, session.target_language)
+    path = await create_analysis_file(session.msg_history, session.target_language)
+    return gr.update(value=path, visible=True)
+
+async def update_analysis_visibility(chat_history, target_language, selected_scenario):
+    """Return a UI update that toggles the analysis export button visibility."""
+    # The conclusion check runs together with a speculative preparation of the analysis, which
+    # is cancelled as soon as the conversation turns out not to be concluded
+    with span("conclusion") as attributes:
+        entry = scenario_entry(selected_scenario, target_language) or {}
+        verdict = outcome_detector.detect(chat_history, entry.get("outcomes")) if len(chat_history) > 2 else False
+        attributes["decided_by"] = "rules" if verdict is not None else "llm"
+        if verdict is False:
+            attributes["concluded"] = False
+            return gr.update(visible=False)
+
+        preparation = asyncio.create_task(prepare_analysis(chat_history, target_language))
+        try:
+            attributes["concluded"] = verdict or await llm_conclusion(chat_history, facts=entry.get("facts"))
+            if attributes["concluded"]:
+                analysis_cache.put(pdf_store.make_key(chat_history, target_language), await preparation)
+                return gr.update(visible=True)
+            return gr.update(visible=False)
+        finally:
+            preparation.cancel()
 
 def load_user_scenario_from_file(file):
     if file is None:
@@ -348,6 +1070,16 @@ def load_user_scenario_from_file(file):
         print(f"Error reading file: {e}")
         return "Error reading file"
 
+async def release_session(request: gr.Request):
+    # Removes the conversation, the audio files and the span timeline and stops the analysis of a
+    # closed session. Async, so the analysis task is cancelled from the event loop that runs it.
+    cancel_analysis(request.session_hash)
+    session_locks.pop(request.session_hash, None)
+    admission.release(request.session_hash)
+    metrics.drop_session(request.session_hash)
+    await session_store_call(session_store.delete, request.session_hash)
+    await run_blocking("session", audio_store.drop_session, request.session_hash)
+
 def change_tab(id):
     return gr.Tabs(selected=id)
 
@@ -362,7 +1094,7 @@ theme = gr.themes.Soft(
     font=["Helvetica", "system-ui", "sans-serif"],
 )
 
-with gr.Blocks(theme=theme) as app:
+with gr.Blocks(theme=theme, delete_cache=GRADIO_CACHE_DELETE) as app:
     gr.Image(LOGO_PATH, show_label=False, container=False, width=10, show_download_button=False, show_fullscreen_button=False, show_share_button=False)
 
     with gr.Tabs() as tabs:
@@ -393,16 +1125,17 @@ with gr.Blocks(theme=theme) as app:
                 conv_file_path = gr.Audio(sources="microphone", interactive=False, type="filepath", label="🎙️ Record")
             with gr.Row():
                 conv_clear_btn = gr.Button("🗑️ Clear", interactive=False)
+            conv_audio_stream = gr.Audio(streaming=True, autoplay=True, interactive=False, show_label=False, container=False, show_download_button=False, visible=STREAM_CHAT)
 
         # --------------- ANALYSIS TAB ---------------
+            analysis_export_btn = gr.Button("📄 Create analysis", visible=False)
             analysis_download_file = gr.File(visible=False, label="⬇️ Download analysis")
 
 
     # General
     html = gr.HTML()
-    msg_history = gr.State([])
-    tts_state = gr.State(None)
     speach_duration = gr.Number(0.0, visible=False)
+    audio_formats = gr.Textbox("", visible=False)
 
 
     # Introduction tab
@@ -410,14 +1143,33 @@ with gr.Blocks(theme=theme) as app:
     setup_scenario_rad.change(fn=toggle_start_button, inputs=[setup_target_language_rad, setup_scenario_rad], outputs=setup_intr_btn)
     setup_scenario_rad.change(fn=toggle_user_scenario_interface, inputs=setup_scenario_rad, outputs=[setup_usr_scenario_text, setup_usr_scenario_file])
     setup_usr_scenario_file.change(fn=load_user_scenario_from_file, inputs=setup_usr_scenario_file, outputs=setup_usr_scenario_text)
-    setup_intr_btn.click(lambda: gr.update(visible=False), inputs=None, outputs=setup_intr_btn).then(lambda: [gr.update(interactive=False)]*4, inputs=None, outputs=[setup_target_language_rad, setup_scenario_rad, setup_usr_scenario_text, setup_usr_scenario_file]).then(fn=lambda: [gr.update(interactive=True)]*2, inputs=None, outputs=[conv_file_path, conv_clear_btn]).then(fn=setup_main, inputs=[setup_target_language_rad, setup_scenario_rad, setup_usr_scenario_text, msg_history], outputs=[html, speach_duration, setup_intr_text, msg_history, tts_state]).then(fn=delay, inputs=speach_duration, outputs=None).then(change_tab, gr.Number(1, visible=False), tabs)
+    setup_intr_btn.click(lambda: gr.update(visible=False), inputs=None, outputs=setup_intr_btn).then(lambda: [gr.update(interactive=False)]*4, inputs=None, outputs=[setup_target_language_rad, setup_scenario_rad, setup_usr_scenario_text, setup_usr_scenario_file]).then(fn=lambda: [gr.update(interactive=True)]*2, inputs=None, outputs=[conv_file_path, conv_clear_btn]).then(fn=wait_for_admission, inputs=None, outputs=setup_intr_text, concurrency_limit=None).then(fn=setup_main, inputs=[setup_target_language_rad, setup_scenario_rad, setup_usr_scenario_text, audio_formats], outputs=[html, speach_duration, setup_intr_text], concurrency_limit=EVENT_LIMITS["setup"]).then(fn=delay, inputs=speach_duration, outputs=None, concurrency_limit=None).then(change_tab, gr.Number(1, visible=False), tabs)
     
     # Conversation tab
-    conv_file_path.change(fn=conv_preview_recording, inputs=[conv_file_path, setup_target_language_rad], outputs=[conv_preview_text]).then(fn=lambda: gr.update(submit_btn=True, interactive=True), inputs=None, outputs=conv_preview_text)
-    conv_preview_text.submit(fn=main, inputs=[conv_preview_text, msg_history, tts_state], outputs=[chatbot, html, conv_file_path, conv_preview_text, msg_history]).then(fn=update_analysis_visibility, inputs=[msg_history, setup_target_language_rad], outputs=analysis_download_file)
+    conv_file_path.change(fn=conv_preview_recording, inputs=[conv_file_path, setup_target_language_rad], outputs=[conv_preview_text], concurrency_limit=EVENT_LIMITS["stt"]).then(fn=lambda: gr.update(submit_btn=True, interactive=True), inputs=None, outputs=conv_preview_text)
+    if STREAM_CHAT:
+        conv_preview_text.submit(fn=main_stream, inputs=conv_preview_text, outputs=[chatbot, conv_audio_stream, conv_file_path, conv_preview_text, analysis_export_btn], concurrency_limit=EVENT_LIMITS["turn"], trigger_mode="multiple")
+    else:
+        conv_preview_text.submit(fn=main, inputs=conv_preview_text, outputs=[chatbot, html, conv_file_path, conv_preview_text, analysis_export_btn], concurrency_limit=EVENT_LIMITS["turn"], trigger_mode="multiple")
+    conv_preview_text.submit(fn=lambda: gr.update(value=None, visible=False), inputs=None, outputs=analysis_download_file, queue=False)
     conv_clear_btn.click(lambda : [None, None], inputs=None, outputs=[conv_file_path, conv_preview_text])
+    analysis_export_btn.click(fn=export_analysis, inputs=None, outputs=analysis_download_file, concurrency_limit=EVENT_LIMITS["export"])
+    app.unload(release_session)
+    app.load(None, inputs=None, outputs=audio_formats, js=AUDIO_FORMATS_JS, queue=False)
+    if WARM_UP != "off":
+        app.load(warm_up_connections, inputs=None, outputs=None, queue=False)
+
+app.queue(default_concurrency_limit=EVENT_LIMITS["default"])
 
 
 if __name__ == "__main__":
-    app.launch(ssr_mode=False, share=True, debug=True)
+    if "--build-bundle" in sys.argv:
+        asyncio.run(build_scenario_bundle(with_audio=BUNDLE_INTRO_AUDIO or "--with-audio" in sys.argv))
+    else:
+        start_metrics_server()  # METRICS_PORT, e.g. 9100
+        if WARM_UP == "blocking":
+            warm_up()
+        elif WARM_UP == "background":
+            threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+        app.launch(ssr_mode=False, share=True, debug=True, allowed_paths=[audio_store.store_dir, pdf_store.export_dir])
 
@@ -0,0 +1,136 @@
+# Admission control for app.py. At most max_active sessions run a conversation at the same time,
+# further new sessions wait in a FIFO queue and are told their position. Conversations that are
+# already running are never queued; they also go first when the stages (LLM, TTS, translation)
+# are saturated: the stage semaphores serve their waiters by the priority of the calling event.
+# The limits are per process.
+import heapq
+import asyncio
+import itertools
+import threading
+import contextvars
+from time import time
+
+from assets.auxiliary_metrics import metrics
+
+# Lower is served first; tasks started by an event (e.g. the speculative analysis) inherit it
+PRIORITIES = {"turn": 0, "export": 1, "default": 1, "setup": 2, "background": 3}
+request_priority = contextvars.ContextVar("request_priority", default=PRIORITIES["default"])
+
+
+def set_priority(event_type):
+    request_priority.set(PRIORITIES[event_type])
+
+
+class PrioritySemaphore():
+    # asyncio semaphore; waiters are served by request_priority, in arrival order within a priority
+    def __init__(self, value):
+        self.value = value
+        self.waiters = []  # heap of (priority, arrival, future)
+        self.arrivals = itertools.count()
+
+    async def acquire(self):
+        if self.value > 0 and not self.waiting():
+            self.value -= 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (request_priority.get(), next(self.arrivals), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Cancelled after the slot was handed over: pass it on
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        while self.waiters:
+            _, _, future = heapq.heappop(self.waiters)
+            if not future.done():  # skips waiters that were cancelled
+                future.set_result(None)
+                return
+        self.value += 1
+
+    def waiting(self):
+        return sum(not future.done() for _, _, future in self.waiters)
+
+    async def __aenter__(self):
+        await self.acquire()
+
+    async def __aexit__(self, *exc_info):
+        self.release()
+
+
+class AdmissionController():
+    # Active sessions by last activity; sessions idle for idle_timeout seconds give up their place
+    def __init__(self, max_active=200, idle_timeout=10 * 60, poll_interval=1.0):
+        self.max_active = max_active
+        self.idle_timeout = idle_timeout
+        self.poll_interval = poll_interval
+        self.active = {}  # session_id -> last activity
+        self.waiting = {}  # session_id -> queued since, in arrival order
+        self.lock = threading.Lock()  # release() is called from Gradio's worker threads
+
+    async def admit(self, session_id):
+        # Async generator: yields the queue position while the session waits, ends once admitted
+        with self.lock:
+            self.release_idle()
+            queued = session_id not in self.active and bool(self.waiting or len(self.active) >= self.max_active)
+            if not queued:
+                self.active[session_id] = time()
+            else:
+                self.waiting.setdefault(session_id, time())
+        metrics.inc("admission_total", queued=str(queued).lower())
+        if not queued:
+            metrics.observe("admission_wait_seconds", 0.0)
+            return
+
+        start = time()
+        try:
+            while True:
+                with self.lock:
+                    self.release_idle()
+                    self.promote()
+                    position = list(self.waiting).index(session_id) + 1 if session_id in self.waiting else None
+                if position is None:
+                    metrics.observe("admission_wait_seconds", time() - start)
+                    return
+                yield position
+                await asyncio.sleep(self.poll_interval)
+        finally:
+            with self.lock:
+                self.waiting.pop(session_id, None)  # admitted, or the user left the queue
+
+    def touch(self, session_id):
+        # Activity of a running conversation; a session that lost its place while idle is let in
+        # again without queueing
+        with self.lock:
+            self.active[session_id] = time()
+
+    def release(self, session_id, reason="closed"):
+        with self.lock:
+            if self.active.pop(session_id, None) is not None:
+                metrics.inc("admission_released_total", reason=reason)
+            self.waiting.pop(session_id, None)
+            self.promote()
+
+    def release_idle(self):
+        deadline = time() - self.idle_timeout
+        for session_id in [session_id for session_id, last_activity in self.active.items() if last_activity < deadline]:
+            del self.active[session_id]
+            metrics.inc("admission_released_total", reason="idle")
+
+    def promote(self):
+        while self.waiting and len(self.active) < self.max_active:
+            session_id = next(iter(self.waiting))
+            del self.waiting[session_id]
+            self.active[session_id] = time()
+
+    def stats(self):
+        with self.lock:
+            oldest = min(self.waiting.values(), default=None)
+            return {
+                "active": len(self.active),
+                "waiting": len(self.waiting),
+                "max_active": self.max_active,
+                "oldest_wait_seconds": time() - oldest if oldest is not None else 0.0,
+            }
@@ -1,114 +1,670 @@
 import os
 import json
 import random
+import hashlib
+import tempfile
+import threading
+import shutil
+import uuid
+from collections import OrderedDict
 from io import BytesIO
 import base64
-import gtts
-from google.cloud import texttospeech
-from google.oauth2 import service_account
-from pydub import AudioSegment
 from time import time
 
-from assets.auxiliary_functions import remove_emojis
+from assets.auxiliary_functions import remove_emojis, audio_duration, text_tokens, split_sentences, ordered_overlap
+from assets.auxiliary_functions import sniff_audio_format, ffmpeg_available, transcode_audio
+from assets.auxiliary_metrics import metrics, span
+
+TTS_REQUEST_TIMEOUT = 8  # seconds per synthesis request, app.py retries and hedges on top
+
+# Output encodings of the speech. Google Cloud TTS renders them natively (encoding, sample rate;
+# None keeps the voice's rate), gTTS only returns 24 kHz MP3 at 32 kbit/s, which is re-encoded
+# with ffmpeg to the bitrate of the preset. "mp3" plays in every browser.
+AUDIO_PRESETS = {
+    "mp3": {"encoding": "MP3", "sample_rate_hertz": None, "bitrate": None, "format": "mp3"},
+    "mp3_low": {"encoding": "MP3", "sample_rate_hertz": 16000, "bitrate": "24k", "format": "mp3"},
+    "opus": {"encoding": "OGG_OPUS", "sample_rate_hertz": 24000, "bitrate": "24k", "format": "ogg"},
+    "opus_low": {"encoding": "OGG_OPUS", "sample_rate_hertz": 16000, "bitrate": "16k", "format": "ogg"},
+}
+AUDIO_MIME_TYPES = {"mp3": "audio/mpeg", "ogg": "audio/ogg"}
+
+
+class AudioCache():
+    # Process-wide cache for synthesized speech. The memory tier is an LRU bounded by
+    # its total size in bytes, the optional disk tier (cache_dir) survives restarts.
+    def __init__(self, max_bytes=64 * 1024 * 1024, cache_dir=None):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(engine, voice_name, audio_config, text):
+        normalized_text = " ".join(remove_emojis(text).split())
+        key_text = "\x1f".join([engine, voice_name, audio_config, normalized_text])
+        return hashlib.sha256(key_text.encode("utf-8")).hexdigest()
+
+    def disk_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.audio")
+
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+
+        if self.cache_dir and os.path.exists(self.disk_path(key)):
+            with open(self.disk_path(key), "rb") as f:
+                data = f.read()
+            with self.lock:
+                self.disk_hits += 1
+            self.put_memory(key, data)
+            return data
+
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, data):
+        self.put_memory(key, data)
+        if self.cache_dir:
+            # Write to a temp file first so that a concurrent reader never sees a partial file
+            os.makedirs(os.path.dirname(self.disk_path(key)), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.disk_path(key)))
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, self.disk_path(key))
+
+    def put_memory(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.size -= len(self.entries.pop(key))
+            self.entries[key] = data
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def get_or_create(self, key, create):
+        data = self.get(key)
+        if data is None:
+            data = create()
+            self.put(key, data)
+        return data
+
+    def stats(self):
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "entries": len(self.entries),
+                "bytes": self.size,
+            }
+
+
+audio_cache = AudioCache(
+    max_bytes=int(os.getenv("TTS_CACHE_MAX_MB", "64")) * 1024 * 1024,
+    cache_dir=os.getenv("TTS_CACHE_DIR"),
+)
+
+
+class TextCache():
+    # Process-wide LRU for text results such as translations, bounded by the number of entries
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(*parts):
+        return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self.entries)}
+
+
+class AudioStore():
+    # Short-lived, session scoped audio files. The browser loads them by URL through Gradio's
+    # file route (which answers Range requests) instead of receiving the mp3 inlined as base64
+    # in the HTML. Files older than ttl seconds are removed, whole sessions on unload.
+    def __init__(self, store_dir, ttl=15 * 60, cleanup_interval=60):
+        self.store_dir = os.path.abspath(store_dir)
+        self.ttl = ttl
+        self.cleanup_interval = cleanup_interval
+        self.last_cleanup = time()
+        self.lock = threading.Lock()
+
+        os.makedirs(self.store_dir, exist_ok=True)
+
+    def session_dir(self, session_id):
+        # Session ids come from the client, only keep safe characters for the directory name
+        return os.path.join(self.store_dir, "".join(c for c in session_id if c.isalnum()) or "anonymous")
+
+    def put(self, session_id, data, suffix=".mp3"):
+        path = self.reserve(session_id, suffix)
+        self.write(path, data)
+        return path
+
+    def reserve(self, session_id, suffix=".mp3"):
+        # Path of a file that is written later, e.g. audio that is still being synthesized
+        os.makedirs(self.session_dir(session_id), exist_ok=True)
+        return os.path.join(self.session_dir(session_id), f"{uuid.uuid4().hex}{suffix}")
+
+    def write(self, path, data):
+        # Renamed into place, a request for the URL never sees a partial file
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".part", "wb") as f:
+            f.write(data)
+        os.replace(path + ".part", path)
+
+    def cleanup_due(self):
+        # True once per cleanup_interval; the caller runs cleanup() then, off the event loop
+        with self.lock:
+            if time() - self.last_cleanup <= self.cleanup_interval:
+                return False
+            self.last_cleanup = time()
+            return True
+
+    def cleanup(self):
+        with self.lock:
+            self.last_cleanup = time()
+        for session_name in os.listdir(self.store_dir):
+            session_dir = os.path.join(self.store_dir, session_name)
+            try:
+                # The session may be dropped (unload) while it is walked
+                for file_name in os.listdir(session_dir):
+                    file_path = os.path.join(session_dir, file_name)
+                    try:
+                        if time() - os.path.getmtime(file_path) > self.ttl:
+                            os.remove(file_path)
+                    except FileNotFoundError:
+                        pass
+                if not os.listdir(session_dir):
+                    shutil.rmtree(session_dir, ignore_errors=True)
+            except (FileNotFoundError, NotADirectoryError):
+                pass
+
+    def drop_session(self, session_id):
+        shutil.rmtree(self.session_dir(session_id), ignore_errors=True)
+
+
+audio_store = AudioStore(os.getenv("AUDIO_STORE_DIR", os.path.join(tempfile.gettempdir(), "sozicheck_audio")))
+
+
+def audio_source(audio_data, session_id=None):
+    # URL of the audio; served from the audio store when a session is known, inline otherwise
+    audio_format = sniff_audio_format(audio_data)
+    if session_id is not None:
+        return f"gradio_api/file={audio_store.put(session_id, audio_data, suffix=f'.{audio_format}')}"
+    return f"data:{AUDIO_MIME_TYPES[audio_format]};base64,{base64.b64encode(audio_data).decode('utf-8')}"
+
+
+def audio_player_html(audio_data, session_id=None):
+    # Audio player for gr.HTML
+    return f'<audio src="{audio_source(audio_data, session_id)}" controls autoplay></audio>'
+
+
+def audio_chunks_html(chunks, session_id=None):
+    # Plays the audio chunks one after the other: the first one starts right away, the next ones
+    # are preloaded and started when the previous one has ended
+    if len(chunks) == 1:
+        return audio_player_html(chunks[0], session_id)
+    players = [f'<audio src="{audio_source(chunks[0], session_id)}" controls autoplay onended="this.nextElementSibling.play()"></audio>']
+    for index, chunk in enumerate(chunks[1:], 2):
+        onended = ' onended="this.nextElementSibling.play()"' if index < len(chunks) else ""
+        players.append(f'<audio src="{audio_source(chunk, session_id)}" preload="auto" hidden{onended}></audio>')
+    return "".join(players)
+
+
+# Pending chunk: starts loading when the previous one starts playing and plays when it has ended.
+# Until the file is in the audio store the request fails; it is retried every 250 ms (for 20 s).
+PENDING_CHUNK_ONERROR = (
+    "const a=this; a.dataset.retries=(+a.dataset.retries||0)+1;"
+    "if(a.dataset.retries<80)setTimeout(()=>{a.src=a.dataset.src+'?retry='+a.dataset.retries;if(a.dataset.wanted)a.play().catch(()=>{})},250)"
+)
+PENDING_CHUNK_ONPLAY = "const n=this.nextElementSibling;if(n&&!n.getAttribute('src'))n.src=n.dataset.src"
+PENDING_CHUNK_ONENDED = "const n=this.nextElementSibling;if(n){n.dataset.wanted=1;n.play().catch(()=>{})}"
+
+
+def audio_pending_html(first_chunk, pending_paths, session_id):
+    # Like audio_chunks_html(), but only the first chunk is ready; the others are files of the
+    # audio store (AudioStore.reserve()) that are written when their synthesis is done
+    players = [f'<audio src="{audio_source(first_chunk, session_id)}" controls autoplay onplay="{PENDING_CHUNK_ONPLAY}" onended="{PENDING_CHUNK_ONENDED}"></audio>']
+    for index, path in enumerate(pending_paths, 2):
+        handlers = f' onplay="{PENDING_CHUNK_ONPLAY}" onended="{PENDING_CHUNK_ONENDED}"' if index <= len(pending_paths) else ""
+        players.append(f'<audio data-src="gradio_api/file={path}" preload="auto" hidden onerror="{PENDING_CHUNK_ONERROR}"{handlers}></audio>')
+    return "".join(players)
+
+
+class ScenarioBundle():
+    # Precomputed scenarios per language (translated role, translated context and optionally
+    # the intro audio). The bundle is tied to the hash of prompts.yaml and is discarded as
+    # soon as the prompts change or the bundle format version is increased. The bundle is read
+    # on first use (or by the warm-up), not when the app is imported.
+    version = 5
+
+    def __init__(self, bundle_dir, prompts_hash):
+        self.bundle_dir = bundle_dir
+        self.prompts_hash = prompts_hash
+        self.bundle_path = os.path.join(self.bundle_dir, "bundle.json")
+        self.entries = {}
+        self.loaded = False
+        self.lock = threading.Lock()
+
+    def ensure_loaded(self):
+        with self.lock:
+            if not self.loaded:
+                self.load()
+                self.loaded = True
+
+    def load(self):
+        if not os.path.exists(self.bundle_path):
+            return
+        with open(self.bundle_path, "r", encoding="utf-8") as f:
+            bundle = json.load(f)
+
+        if bundle.get("version") != self.version or bundle.get("prompts_hash") != self.prompts_hash:
+            print("Scenario bundle is outdated and will be rebuilt.")
+            return
+
+        self.entries = bundle["entries"]
+        for entry in self.entries.values():
+            # Preload the intro audio (one file per chunk) so that create_audio() does not hit the TTS
+            for audio in entry.get("audio", []):
+                with open(os.path.join(self.bundle_dir, audio["file"]), "rb") as f:
+                    audio_cache.put_memory(audio["key"], f.read())
+        print(f"Loaded scenario bundle with {len(self.entries)} entries.")
+
+    def save(self):
+        bundle = {"version": self.version, "prompts_hash": self.prompts_hash, "entries": self.entries}
+        os.makedirs(self.bundle_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.bundle_dir)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(bundle, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.bundle_path)
+
+    @staticmethod
+    def make_key(scenario, language):
+        return f"{scenario}|{language}"
+
+    def get(self, scenario, language):
+        self.ensure_loaded()
+        return self.entries.get(self.make_key(scenario, language))
+
+    def set(self, scenario, language, entry, audio=None):
+        # audio: [(cache key, audio bytes)] of the intro chunks
+        self.ensure_loaded()
+        if audio:
+            os.makedirs(self.bundle_dir, exist_ok=True)
+            entry["audio"] = []
+            for key, data in audio:
+                entry["audio"].append({"key": key, "file": f"{key}.{sniff_audio_format(data)}"})
+                with open(os.path.join(self.bundle_dir, entry["audio"][-1]["file"]), "wb") as f:
+                    f.write(data)
+
+        with self.lock:
+            self.entries[self.make_key(scenario, language)] = entry
+            self.save()
+
+
+class OutcomeDetector():
+    # Decides locally whether a conversation reached one of the verbatim outcomes of the scenario
+    # (in the language of the conversation). detect() returns True (concluded), False (clearly
+    # still collecting data) or None when the case is ambiguous and the LLM has to decide.
+    def __init__(self, concluded_threshold=0.8, open_threshold=0.5):
+        self.concluded_threshold = concluded_threshold
+        self.open_threshold = open_threshold
+        self.lock = threading.Lock()
+        self.counts = {"concluded": 0, "not_concluded": 0, "escalated": 0}
+
+    @staticmethod
+    def marker_score(message_tokens, marker):
+        # Share of the marker's words that appear in the message in the same order,
+        # so a question reusing the words does not match
+        return ordered_overlap(text_tokens(marker), message_tokens)
+
+    def detect(self, chat_history, markers):
+        assistant_messages = [msg["content"] for msg in chat_history[1:] if msg["role"] == "assistant"]
+        if not markers or not assistant_messages:
+            return self.count(None)
+
+        best_score = 0.0
+        for index, message in enumerate(reversed(assistant_messages)):
+            message_tokens = text_tokens(message)
+            score = max(self.marker_score(message_tokens, marker) for marker in markers)
+            if score >= self.concluded_threshold and "?" not in message:
+                return self.count(True)
+            if index == 0:
+                best_score = score
+
+        # The flow asks exactly one question per message until the result is given
+        if "?" in assistant_messages[-1] and best_score < self.open_threshold:
+            return self.count(False)
+        return self.count(None)
+
+    def count(self, verdict):
+        with self.lock:
+            self.counts[{True: "concluded", False: "not_concluded", None: "escalated"}[verdict]] += 1
+        return verdict
+
+    def stats(self):
+        with self.lock:
+            return {**self.counts, "llm_calls_avoided": self.counts["concluded"] + self.counts["not_concluded"]}
+
+
+outcome_detector = OutcomeDetector()
+
+
+class HistoryManager():
+    # Keeps the messages sent to the chat model within a token budget. The system prompt and the
+    # recent turns are sent verbatim, older turns are folded into a fact sheet of the answers
+    # collected so far. Turns are folded in blocks, so the prefix (system prompt + fact sheet)
+    # stays byte-identical over several turns and provider-side prompt caching can hit.
+    def __init__(self, token_budget=1500, keep_turns=3, fold_turns=3):
+        self.token_budget = token_budget
+        self.keep_turns = keep_turns
+        self.fold_turns = fold_turns
+        self.encoding = None
+        self.encoding_loaded = False
+        self.lock = threading.Lock()
+
+    def get_encoding(self):
+        # tiktoken is imported on first use (or by the warm-up); its first use downloads the BPE
+        # file, so without tiktoken or offline the rough estimate is used
+        with self.lock:
+            if not self.encoding_loaded:
+                self.encoding_loaded = True
+                try:
+                    import tiktoken
+                    self.encoding = tiktoken.get_encoding("o200k_base")
+                except Exception as e:
+                    print(f"tiktoken not available, estimating tokens from the text length: {e!r}")
+        return self.encoding
+
+    def estimate_tokens(self, messages):
+        text = "".join(msg["content"] or "" for msg in messages)
+        encoding = self.get_encoding()
+        if encoding is not None:
+            return len(encoding.encode(text)) + 4 * len(messages)
+        return len(text) // 4 + 4 * len(messages)  # rough estimate without tiktoken
+
+    def compact(self, msg_history, facts=None):
+        if self.estimate_tokens(msg_history) <= self.token_budget:
+            return msg_history
+
+        # Fold whole blocks of turns (user + assistant) and keep at least keep_turns verbatim
+        turns = msg_history[1:]
+        foldable_turns = max(0, (len(turns) - 2 * self.keep_turns) // 2)
+        folded_turns = foldable_turns - foldable_turns % self.fold_turns
+        if folded_turns == 0:
+            return msg_history
+
+        fact_sheet = self.fact_sheet(turns[:2 * folded_turns], facts or {})
+        return [msg_history[0], {"role": "system", "content": fact_sheet}] + turns[2 * folded_turns:]
+
+    @staticmethod
+    def question_of(message):
+        # The first question of an assistant message, or its beginning if it asks none
+        sentences, _ = split_sentences(message + "\n", min_length=0)
+        return next((sentence for sentence in sentences if sentence.endswith("?")), message.strip()[:120])
+
+    def fact_sheet(self, folded_messages, facts):
+        # Pairs every answer with the question before it, labelled with the fact it belongs to
+        slots = {slot: [text_tokens(keyword) for keyword in keywords.split(",")] for slot, keywords in facts.items()}
+        lines = ["Bisher erfasste Angaben (ältere Nachrichten zusammengefasst):"]
+        question = None
+        for msg in folded_messages:
+            if msg["role"] == "assistant":
+                question = self.question_of(msg["content"])
+            elif question is not None:
+                question_tokens = text_tokens(question)
+                slot = next((
+                    slot for slot, keywords in slots.items()
+                    if any(keyword and all(token in question_tokens for token in keyword) for keyword in keywords)
+                ), "other")
+                lines.append(f"- {slot}: {question} -> {msg['content'].strip()}")
+                question = None
+        return "\n".join(lines)
+
+
+class TextToSpeechClientPool():
+    # Process-wide Google TTS clients shared by all sessions. The clients are created on first
+    # use and handed out round robin; every client multiplexes its requests over one gRPC
+    # channel, so the number of channels stays fixed no matter how many users are active.
+    def __init__(self, pool_size=1):
+        self.pool_size = pool_size
+        self.clients = []
+        self.next_index = 0
+        self.lock = threading.Lock()
+
+    def create_client(self):
+        from google.cloud import texttospeech
+        from google.cloud.texttospeech_v1.services.text_to_speech.transports import TextToSpeechGrpcTransport
+        from google.oauth2 import service_account
+
+        creds_json = os.getenv("GOOGLE_CREDENTIALS").replace("\n", "\\n")
+        google_api_key = json.loads(creds_json)
+        credentials = service_account.Credentials.from_service_account_info(google_api_key)
+        channel = TextToSpeechGrpcTransport.create_channel(
+            credentials=credentials,
+            options=[
+                ("grpc.keepalive_time_ms", 30000),
+                ("grpc.keepalive_permit_without_calls", 1),
+            ],
+        )
+        return texttospeech.TextToSpeechClient(transport=TextToSpeechGrpcTransport(channel=channel))
+
+    def get(self):
+        with self.lock:
+            if not self.clients:
+                self.clients = [self.create_client() for _ in range(self.pool_size)]
+            client = self.clients[self.next_index % self.pool_size]
+            self.next_index += 1
+        return client
+
+
+class VoiceCatalog():
+    # Google TTS voice names indexed by language code, refreshed after ttl seconds
+    def __init__(self, client_pool, ttl=6 * 3600):
+        self.client_pool = client_pool
+        self.ttl = ttl
+        self.voices_by_language = {}
+        self.loaded_at = None
+        self.lock = threading.Lock()
+
+    def refresh(self):
+        voices_by_language = {}
+        for voice in self.client_pool.get().list_voices().voices:
+            for lang_code in voice.language_codes:
+                voices_by_language.setdefault(lang_code, []).append(voice.name)
+        self.voices_by_language = voices_by_language
+        self.loaded_at = time()
+
+    def voices(self, lang_code):
+        with self.lock:
+            if self.loaded_at is None or time() - self.loaded_at > self.ttl:
+                self.refresh()
+            return self.voices_by_language.get(lang_code, [])
+
+
+tts_client_pool = TextToSpeechClientPool(pool_size=int(os.getenv("TTS_CHANNEL_POOL_SIZE", "1")))
+voice_catalog = VoiceCatalog(tts_client_pool)
+
+
+def synthesize_cached(tts_instance, engine, rec_text):
+    # Cache lookup and synthesis of both engines, traced as "tts" (and "tts.request" on a cache miss)
+    def request():
+        with span("tts.request", engine=engine, voice=tts_instance.voice_name, characters=len(rec_text)):
+            return tts_instance.request_audio(rec_text)
+
+    with span("tts", engine=engine, characters=len(rec_text)) as attributes:
+        audio_data = audio_cache.get_or_create(tts_instance.cache_key(rec_text), request)
+        duration = audio_duration(audio_data)
+        attributes.update(audio_s=round(duration, 2), bytes=len(audio_data), preset=tts_instance.preset)
+        metrics.inc("tts_audio_seconds_total", duration, engine=engine)
+        metrics.inc("tts_audio_bytes_total", len(audio_data), engine=engine, preset=tts_instance.preset)
+    return audio_data
 
 
 class TextToSpeechCloud():
-    def __init__(self, language_dict, target_language):
+    # Per session only the chosen voice and the audio config are kept, the gRPC client and
+    # the voice catalog are shared by the whole process. settings() is what a session stores
+    # to create the same speaker again in another worker.
+    engine = "google_cloud"
+
+    def __init__(self, language_dict, target_language, voice_name=None, session_id=None, speaking_rate=1, pitch=1, preset="mp3"):
         self.language_dict = language_dict
         self.target_language = target_language
         self.lang_code = self.language_dict[self.target_language][1]
+        self.voice_name = voice_name
+        self.session_id = session_id  # None delivers the audio inline as base64
+        self.speaking_rate = speaking_rate
+        self.pitch = pitch
+        self.preset = preset if preset in AUDIO_PRESETS else "mp3"
         self.tts_conf_state = {}
-        self.tts_client = None
 
-        self.initialize_client()
         self.initialize_voice()
 
-    def initialize_client(self):
-        creds_json = os.getenv("GOOGLE_CREDENTIALS").replace("\n", "\\n")
-        google_api_key = json.loads(creds_json)
-        credentials = service_account.Credentials.from_service_account_info(google_api_key)
-        self.tts_client = texttospeech.TextToSpeechClient(credentials=credentials)
+    @property
+    def tts_client(self):
+        return tts_client_pool.get()
 
     def initialize_voice(self):
-        voices = self.tts_client.list_voices().voices
+        from google.cloud import texttospeech
+
         filtered_voices = [
-            voice
-            for voice in voices
-            if self.lang_code in voice.language_codes and "WAVENET" in voice.name.upper()  # Premium voice: "STUDIO"
+            voice_name
+            for voice_name in voice_catalog.voices(self.lang_code)
+            if "WAVENET" in voice_name.upper()  # Premium voice: "STUDIO"
         ]  # Filter for standard voices
-        selected_voice = random.choice(filtered_voices)
+        selected = self.voice_name not in filtered_voices
+        if selected:
+            self.voice_name = random.choice(filtered_voices)
 
         self.tts_conf_state["voice"] = texttospeech.VoiceSelectionParams(
-            language_code=self.lang_code, name=selected_voice.name
+            language_code=self.lang_code, name=self.voice_name
         )  # Use the selected voice name
 
+        preset = AUDIO_PRESETS[self.preset]
         self.tts_conf_state["audo_config"] = texttospeech.AudioConfig(
-            audio_encoding=texttospeech.AudioEncoding.MP3,
-            speaking_rate=1,
-            pitch=1,
-        )
-        print(
-            f"Selected voice: {selected_voice.name}, pitch: {self.tts_conf_state['audo_config'].pitch}, speaking rate: {self.tts_conf_state['audo_config'].speaking_rate}"
+            audio_encoding=texttospeech.AudioEncoding[preset["encoding"]],
+            speaking_rate=self.speaking_rate,
+            pitch=self.pitch,
+            sample_rate_hertz=preset["sample_rate_hertz"] or 0,  # 0: natural rate of the voice
         )
+        if selected:
+            print(
+                f"Selected voice: {self.voice_name}, pitch: {self.tts_conf_state['audo_config'].pitch}, speaking rate: {self.tts_conf_state['audo_config'].speaking_rate}"
+            )
+
+    def settings(self):
+        return {"engine": self.engine, "voice_name": self.voice_name, "speaking_rate": self.speaking_rate, "pitch": self.pitch, "preset": self.preset}
     
-    def create_audio(self, rec_text):
-        start = time()
+    def cache_key(self, rec_text):
+        audio_config = self.tts_conf_state["audo_config"]
+        config_key = f"{self.preset}:{audio_config.speaking_rate}:{audio_config.pitch}"
+        return AudioCache.make_key("google_cloud", self.voice_name, config_key, rec_text)
+
+    def synthesize(self, rec_text):
+        # Returns the raw mp3 bytes of the spoken text, served from the audio cache when possible
+        return synthesize_cached(self, "google_cloud", rec_text)
+
+    def request_audio(self, rec_text):
+        from google.cloud import texttospeech
+
         rec_text = remove_emojis(rec_text)
         synthesis_input = texttospeech.SynthesisInput(text=rec_text)
         response = self.tts_client.synthesize_speech(
             input=synthesis_input,
             voice=self.tts_conf_state["voice"],
             audio_config=self.tts_conf_state["audo_config"],
+            timeout=TTS_REQUEST_TIMEOUT,
         )
+        return response.audio_content
 
-        # Convert the audio content to a Base64 string
-        audio_bytes = BytesIO(response.audio_content)
-        
-        audio_bytes.seek(0)
-        # tts.write_to_fp(audio_bytes)
-        mp3_data = audio_bytes.getvalue()
+    def create_audio(self, rec_text):
+        audio_data = self.synthesize(rec_text)
 
         # Create the audio player HTML
-        audio = base64.b64encode(audio_bytes.read()).decode("utf-8")
-        audio_player = f'<audio src="data:audio/mpeg;base64,{audio}" controls autoplay></audio>'
-
-
-        # Get duration using pydub
-        audio_segment = AudioSegment.from_file(BytesIO(mp3_data), format="mp3")
-        duration = audio_segment.duration_seconds  # Duration in seconds
-        print(f"Duration speach: {duration:.2f} seconds")
+        audio_player = audio_player_html(audio_data, self.session_id)
 
-        print(f"Time text2speach_google: {time()-start}")
+        # Get duration from the frame/page headers (the v1 API returns no duration metadata)
+        duration = audio_duration(audio_data)
 
         return audio_player, duration
 
 
 class TextToSpeechGTTS():
-    def __init__(self, language_dict, target_language):
+    engine = "gtts"
+
+    def __init__(self, language_dict, target_language, voice_name=None, session_id=None, preset="mp3", **audio_config):
         self.language_dict = language_dict
         self.target_language = target_language
+        self.voice_name = self.language_dict[self.target_language][0]  # gTTS has one voice per language
+        self.session_id = session_id  # None delivers the audio inline as base64
+        # Other presets than the native mp3 need ffmpeg
+        self.preset = preset if preset in AUDIO_PRESETS and (preset == "mp3" or ffmpeg_available()) else "mp3"
+
+    def settings(self):
+        return {"engine": self.engine, "voice_name": self.voice_name, "preset": self.preset}
+
+    def cache_key(self, rec_text):
+        return AudioCache.make_key("gtts", self.voice_name, self.preset, rec_text)
+
+    def synthesize(self, rec_text):
+        # Returns the raw mp3 bytes of the spoken text, served from the audio cache when possible
+        return synthesize_cached(self, "gtts", rec_text)
+
+    def request_audio(self, rec_text):
+        import gtts
 
-    def create_audio(self, rec_text):
-        start = time()
         # Make request to google to get synthesis
         rec_text_filtered = remove_emojis(rec_text)
-        tts = gtts.gTTS(rec_text_filtered, lang=self.language_dict[self.target_language][0])
+        tts = gtts.gTTS(rec_text_filtered, lang=self.language_dict[self.target_language][0], timeout=TTS_REQUEST_TIMEOUT)
 
         audio_bytes = BytesIO()
         tts.write_to_fp(audio_bytes)
-        audio_bytes.seek(0)
+        if self.preset == "mp3":
+            return audio_bytes.getvalue()
+        preset = AUDIO_PRESETS[self.preset]
+        return transcode_audio(audio_bytes.getvalue(), preset["format"], bitrate=preset["bitrate"], sample_rate=preset["sample_rate_hertz"])
 
-        mp3_data = audio_bytes.getvalue()
+    def create_audio(self, rec_text):
+        audio_data = self.synthesize(rec_text)
 
-        # Convert audio to base64
-        audio = base64.b64encode(mp3_data).decode("utf-8")
-        audio_player = f'<audio src="data:audio/mpeg;base64,{audio}" controls autoplay></audio>'
-        
-        # Get duration using pydub
-        audio_segment = AudioSegment.from_file(BytesIO(mp3_data), format="mp3")
-        duration = audio_segment.duration_seconds  # Duration in seconds
-        print(f"Duration speach: {duration:.2f} seconds")
+        # Create the audio player HTML
+        audio_player = audio_player_html(audio_data, self.session_id)
         
-        end = time()
-        print(f"Time text2speach: {end-start}")
-        return audio_player, duration
\ No newline at end of file
+        # Get duration from the frame/page headers
+        duration = audio_duration(audio_data)
+        return audio_player, duration
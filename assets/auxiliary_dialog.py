@@ -0,0 +1,218 @@
+# Rule based fast path for the scripted steps of a scenario. The numbered flow in the role prompt
+# (prompts.yaml) is parsed into steps; unambiguous answers to closed questions (yes/no, a choice
+# from a fixed list) are answered locally with the next scripted text, everything else goes to the LLM.
+import re
+import threading
+
+from assets.auxiliary_functions import text_tokens, ordered_overlap
+
+# Yes/no words per language code of language_dict. Only words that are an answer on their own:
+# negation particles ("nicht", "pas", "not", ...) also occur in "I don't know" and "not sure"
+yes_no_words = {
+    "de": ({"ja", "jawohl", "genau", "stimmt", "richtig"}, {"nein", "nö", "ne"}),
+    "it": ({"sì", "si", "certo", "esatto"}, {"no"}),
+    "pt": ({"sim", "claro", "exato"}, {"não", "nao"}),
+    "fr": ({"oui", "exact", "exactement"}, {"non"}),
+    "sq": ({"po", "sigurisht"}, {"jo"}),
+    "es": ({"sí", "si", "claro", "exacto"}, {"no"}),
+    "tr": ({"evet", "tabii"}, {"hayır", "hayir", "yok"}),
+    "mk": ({"да", "da"}, {"не", "ne"}),
+    "uk": ({"так", "tak", "звісно"}, {"ні", "ni"}),
+    "en": ({"yes", "yeah", "yep", "correct"}, {"no", "nope"}),
+}
+
+# Answers that contain one of these phrases (all of its words) are unclear and go to the LLM,
+# even next to a yes/no word ("nein, ich weiss es nicht mehr")
+unsure_phrases = {
+    "de": ["weiss nicht", "nicht sicher", "keine ahnung", "unsicher", "vielleicht", "weiss es nicht"],
+    "it": ["non lo so", "non so", "non sono sicuro", "non sono sicura", "forse"],
+    "pt": ["não sei", "nao sei", "não tenho certeza", "talvez"],
+    "fr": ["ne sais pas", "sais pas", "pas sûr", "pas sûre", "aucune idée", "peut être"],
+    "sq": ["nuk e di", "nuk jam i sigurt", "nuk jam e sigurt", "ndoshta"],
+    "es": ["no sé", "no se", "no estoy seguro", "no estoy segura", "quizás", "tal vez"],
+    "tr": ["bilmiyorum", "emin değilim", "belki"],
+    "mk": ["не знам", "ne znam", "не сум сигурен", "можеби"],
+    "uk": ["не знаю", "не впевнений", "не впевнена", "можливо"],
+    "en": ["not know", "don t know", "dont know", "not sure", "no idea", "maybe", "unsure"],
+}
+
+MAX_ANSWER_TOKENS = 6
+QUESTION_MATCH_THRESHOLD = 0.8
+
+step_header_pattern = re.compile(r"^\s*\d+\)\s+\S.*$", re.M)
+item_pattern = re.compile(r"“(?P<quote>[^”]*)”|^(?P<line>[^\n“”]+)$", re.M)
+
+
+def parse_flow(role_text):
+    # Returns the steps of the numbered flow. A step is a dict with the question, its kind
+    # ("yes_no", "choice" or "free"), the options of a choice and the actions "yes", "no" and
+    # "then". An action is {"type": "next"} or {"type": "say", "text": ..., "stop": bool}.
+    headers = list(step_header_pattern.finditer(role_text))
+    steps = []
+    for index, header in enumerate(headers):
+        end = headers[index + 1].start() if index + 1 < len(headers) else len(role_text)
+        steps.append(parse_step(role_text[header.end():end]))
+    return steps
+
+
+def parse_step(section):
+    step = {"question": None, "kind": "free", "options": [], "yes": None, "no": None, "then": None}
+    structured = True
+    branch = None
+    expects_question = False
+
+    for item in item_pattern.finditer(section):
+        if item.group("quote") is not None:
+            text = "\n".join(line.strip() for line in item.group("quote").strip().splitlines())
+            if branch is not None:
+                step[branch] = {"type": "say", "text": text, "stop": False}
+            elif expects_question and step["question"] is None:
+                step["question"] = text
+            expects_question = False
+            continue
+
+        line = item.group("line").strip()
+        branch_match = re.match(r"Wenn (Ja|Nein)\b", line)
+        if branch_match:
+            branch = "yes" if branch_match.group(1) == "Ja" else "no"
+            if "weiter" in line:
+                step[branch] = {"type": "next"}
+                branch = None
+        elif line.startswith("Wenn"):
+            structured = False  # any other condition needs the LLM
+            branch = None
+        elif line.startswith("Frage"):
+            expects_question = True
+        elif line.startswith("STOP"):
+            if branch is not None and step[branch] is not None:
+                step[branch]["stop"] = True
+            branch = None
+        elif line.startswith("Dann weiter"):
+            step["then"] = {"type": "next"}
+            branch = None
+        elif line.startswith("Bei"):
+            expects_question = False  # e.g. the follow-up question when the answer is unclear
+
+    question = step["question"]
+    if not structured or question is None:
+        return step
+    if "Ja oder Nein" in question:
+        step["kind"] = "yes_no"
+    elif step["then"] is not None:
+        lines = [line for line in question.splitlines() if line.endswith("?")]
+        if len(lines) >= 3:
+            step["kind"] = "choice"
+            step["options"] = lines[1:]
+    return step
+
+
+def flow_texts(steps):
+    # All texts of a flow in a fixed order, e.g. to translate them
+    texts = []
+    for step in steps:
+        texts += [step["question"] or ""] + step["options"]
+        texts += [step[name]["text"] for name in ("yes", "no", "then") if step[name] and step[name]["type"] == "say"]
+    return texts
+
+
+def replace_flow_texts(steps, texts):
+    # Copy of the flow with the texts (same order as flow_texts) replaced
+    texts = iter(texts)
+    translated_steps = []
+    for step in steps:
+        translated = {**step, "question": next(texts) or None}
+        translated["options"] = [next(texts) for _ in step["options"]]
+        for name in ("yes", "no", "then"):
+            if step[name] and step[name]["type"] == "say":
+                translated[name] = {**step[name], "text": next(texts)}
+        translated_steps.append(translated)
+    return translated_steps
+
+
+class DialogFlow():
+    # Answers a user message locally when it is an unambiguous answer to the scripted question
+    # the assistant asked last. reply() returns the next scripted text or None for the LLM.
+    def __init__(self, steps, lang_code):
+        self.steps = steps
+        self.yes_words, self.no_words = yes_no_words.get(lang_code, (set(), set()))
+        self.unsure_phrases = [text_tokens(phrase) for phrase in unsure_phrases.get(lang_code, [])]
+        self.question_tokens = [text_tokens(step["question"] or "") for step in steps]
+
+    def current_step(self, assistant_message):
+        message_tokens = text_tokens(assistant_message)
+        for index, tokens in enumerate(self.question_tokens):
+            if tokens and ordered_overlap(tokens, message_tokens) >= QUESTION_MATCH_THRESHOLD:
+                return index
+        return None
+
+    def is_unsure(self, answer_tokens):
+        return any(all(token in answer_tokens for token in phrase) for phrase in self.unsure_phrases)
+
+    def classify_yes_no(self, answer_tokens):
+        is_yes = any(token in self.yes_words for token in answer_tokens)
+        is_no = any(token in self.no_words for token in answer_tokens)
+        if is_yes != is_no:
+            return "yes" if is_yes else "no"
+        return None
+
+    @staticmethod
+    def classify_choice(answer_tokens, options):
+        # An answer is clear if it names a single permit letter or words only one option contains
+        option_tokens = [set(text_tokens(option)) for option in options]
+        letters = [{token for token in tokens if len(token) == 1} for tokens in option_tokens]
+        matched_letters = {token for token in answer_tokens if len(token) == 1 and any(token in option_letters for option_letters in letters)}
+        matched_options = {
+            index for index, tokens in enumerate(option_tokens)
+            if any(len(token) >= 6 and token in tokens and all(token not in other for other in option_tokens if other is not tokens) for token in answer_tokens)
+        }
+        matched_letters |= {letter for index in matched_options for letter in letters[index]}
+        if len(matched_letters) == 1 or (not matched_letters and len(matched_options) == 1):
+            return "then"
+        return None
+
+    def action_text(self, index, action):
+        if action is None:
+            return None
+        if action["type"] == "say":
+            return action["text"]
+        if index + 1 < len(self.steps):
+            return self.steps[index + 1]["question"]  # None when the next step has no scripted question
+        return None
+
+    def reply(self, assistant_message, user_message):
+        index = self.current_step(assistant_message)
+        if index is None:
+            return None
+        step = self.steps[index]
+        answer_tokens = text_tokens(user_message)
+        # A question back ("Was genau meinen Sie?") is no answer, even if it contains a yes word
+        if not answer_tokens or len(answer_tokens) > MAX_ANSWER_TOKENS or "?" in user_message or self.is_unsure(answer_tokens):
+            return None
+
+        if step["kind"] == "yes_no":
+            answer = self.classify_yes_no(answer_tokens)
+            action = answer and (step[answer] or step["then"])
+        elif step["kind"] == "choice":
+            answer = self.classify_choice(answer_tokens, step["options"])
+            action = answer and step["then"]
+        else:
+            return None
+        return self.action_text(index, action)
+
+
+class DialogStats():
+    # Counts which path answered the turns
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {"rules": 0, "llm": 0}
+
+    def count(self, path):
+        with self.lock:
+            self.counts[path] += 1
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counts)
+
+
+dialog_stats = DialogStats()
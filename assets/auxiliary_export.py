@@ -0,0 +1,224 @@
+# PDF export of the analysis. Styles and the decoded logo are created once per process, finished
+# PDFs are kept in an export directory keyed by the hash of the transcript, so a repeated download
+# of the same conversation does not render the document again. The directory is bounded by a TTL
+# and a total size; the oldest files are evicted first. reportlab is imported on first render.
+import os
+import json
+import hashlib
+import tempfile
+import threading
+from io import BytesIO
+from time import time
+from datetime import datetime
+from functools import lru_cache
+
+from assets.auxiliary_functions import remove_emojis
+
+
+@lru_cache(maxsize=None)
+def pdf_styles():
+    # (styles, user_style, assistant_style), shared by all documents
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.lib.enums import TA_LEFT
+
+    styles = getSampleStyleSheet()
+    user_style = ParagraphStyle(name="UserChat",parent=styles["Normal"],alignment=TA_LEFT,fontSize=10,leading=13,spaceAfter=5,leftIndent=0)
+    assistant_style = ParagraphStyle(name="AssistantChat",parent=styles["Normal"],alignment=TA_LEFT,fontSize=10,leading=13,spaceAfter=5,leftIndent=25)
+    return styles, user_style, assistant_style
+
+
+@lru_cache(maxsize=8)
+def logo_image(logo_path):
+    # Decoded logo or None if the file does not exist
+    if not logo_path or not os.path.exists(logo_path):
+        return None
+    from reportlab.lib.utils import ImageReader
+
+    with open(logo_path, "rb") as f:
+        image = ImageReader(BytesIO(f.read()))
+    image.getRGBData()  # decode now, the reader is shared between render threads afterwards
+    return image
+
+
+def add_header_and_page_number(canvas, doc):
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.units import cm
+
+    canvas.saveState()
+
+    # Page number (bottom center)
+    page_num = canvas.getPageNumber()
+    canvas.setFont("Helvetica", 9)
+    canvas.drawCentredString(A4[0] / 2, 1 * cm, f"Seite {page_num}")
+
+    # Header logo (top left)
+    logo = logo_image(getattr(doc, "logo_path", None))
+    if logo is not None:
+        canvas.drawImage(logo, 1 * cm, A4[1] - 3 * cm, width=3 * cm, height=3 * cm, preserveAspectRatio=True, mask="auto")
+
+    # Header line
+    canvas.line(1 * cm, A4[1] - 3.2 * cm, A4[0] - 1 * cm, A4[1] - 3.2 * cm)
+
+    canvas.restoreState()
+
+
+def render_analysis_pdf(output, msg_history, target_language, summary, texts_german, logo_path=None):
+    # Writes the analysis document to output (a path or a binary file object)
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.units import cm
+
+    timestamp = datetime.now().strftime("%Y-%m-%d")
+
+    doc = SimpleDocTemplate(output, pagesize=A4,
+                            topMargin=3.5 * cm, bottomMargin=2 * cm,
+                            leftMargin=2 * cm, rightMargin=2 * cm)
+
+    doc.logo_path = logo_path  # store for canvas callback
+
+    styles, user_style, assistant_style = pdf_styles()
+    flow = []
+
+    flow.append(Paragraph(f"<b>Exportdatum:</b> {timestamp}", styles['Normal']))
+    flow.append(Spacer(1, 12))
+
+    flow.append(Paragraph("<b>Sozialhilfe-Check St.Gallen</b>", styles['Heading2']))
+    flow.append(Spacer(1, 12))
+
+    flow.append(Paragraph("<b>DEUTSCH</b>", styles['Heading3']))
+    flow.append(Paragraph("<b>Übersicht:</b>"))
+    flow.append(Spacer(1, 8))
+
+    for line in summary.split("\n"):
+        if line.strip():
+            flow.append(Paragraph(line.strip(), styles["Normal"]))
+            flow.append(Spacer(1, 4))
+
+    flow.append(Spacer(1, 12))
+    flow.append(Spacer(1, 12))
+    for msg, text in zip(msg_history[2:], texts_german):
+        text = text.replace("\n", "<br/>")
+        if msg["role"] == "user":
+            flow.append(Paragraph(f"<b>Beantragende:r:</b> {text}", user_style))
+        else:
+            flow.append(Paragraph(f"<b>Sozi-Bot:</b> {text}", assistant_style))
+    flow.append(Spacer(1, 12))
+    if target_language != 'german':
+        flow.append(Paragraph(f"<b>{target_language.capitalize()}</b>", styles['Heading3']))
+        for msg in msg_history[2:]:
+            text = remove_emojis(msg["content"]).replace("\n", "<br/>")
+            if msg["role"] == "user":
+                flow.append(Paragraph(f"<b>Beantragende:r:</b> {text}", user_style))
+            else:
+                flow.append(Paragraph(f"<b>Sozi-Bot:</b> {text}", assistant_style))
+        flow.append(Spacer(1, 12))
+
+    # Build with custom header/footer for each page
+    doc.build(flow,
+              onFirstPage=add_header_and_page_number,
+              onLaterPages=add_header_and_page_number)
+
+
+def write_atomic(path, render):
+    # render(file object) writes the document to a temporary file next to path (descriptor closed
+    # after writing), which is then renamed into place, so a concurrent download never sees a half
+    # written document. A module level function, so it can run in a worker process.
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            render(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+    return path
+
+
+class PdfExportStore():
+    # Finished PDFs by transcript key, written with write_atomic()
+    def __init__(self, export_dir, ttl=60 * 60, max_bytes=256 * 1024 * 1024, cleanup_interval=60):
+        self.export_dir = os.path.abspath(export_dir)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.cleanup_interval = cleanup_interval
+        self.last_cleanup = time()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(self.export_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(msg_history, target_language):
+        transcript = [(msg["role"], msg["content"]) for msg in msg_history]
+        return hashlib.sha256(json.dumps([target_language, transcript], ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.export_dir, f"analyse_{key[:16]}.pdf")
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            os.utime(path)  # keeps recently downloaded files from being evicted
+        except FileNotFoundError:
+            with self.lock:
+                self.misses += 1
+            return None
+        with self.lock:
+            self.hits += 1
+        return path
+
+    def create(self, key, render):
+        # render(file object) writes the document
+        path = write_atomic(self.path(key), render)
+        self.created()
+        return path
+
+    def created(self):
+        # Called after a document was added (also by writers in other processes)
+        if time() - self.last_cleanup > self.cleanup_interval:
+            self.cleanup()
+
+    def cleanup(self):
+        with self.lock:
+            self.last_cleanup = time()
+            files = []
+            for file_name in os.listdir(self.export_dir):
+                file_path = os.path.join(self.export_dir, file_name)
+                try:
+                    stat = os.stat(file_path)
+                except FileNotFoundError:
+                    continue
+                if time() - stat.st_mtime > self.ttl:
+                    self.remove(file_path)
+                else:
+                    files.append((stat.st_mtime, stat.st_size, file_path))
+
+            # Over the size limit: evict the least recently used files
+            total = sum(size for _, size, _ in files)
+            for _, size, file_path in sorted(files):
+                if total <= self.max_bytes:
+                    break
+                self.remove(file_path)
+                total -= size
+
+    @staticmethod
+    def remove(file_path):
+        try:
+            os.remove(file_path)
+        except FileNotFoundError:
+            pass
+
+    def stats(self):
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "files": len(os.listdir(self.export_dir))}
+
+
+pdf_store = PdfExportStore(
+    os.getenv("PDF_EXPORT_DIR", os.path.join(tempfile.gettempdir(), "sozicheck_pdf")),
+    ttl=int(os.getenv("PDF_EXPORT_TTL", "3600")),
+    max_bytes=int(os.getenv("PDF_EXPORT_MAX_MB", "256")) * 1024 * 1024,
+)
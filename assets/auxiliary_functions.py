@@ -1,5 +1,8 @@
 # This file contains helper functions for app.py
 import re
+import shutil
+import struct
+from functools import lru_cache
 
 
 def remove_emojis(text):
@@ -23,4 +26,218 @@ def remove_emojis(text):
         flags=re.UNICODE,
     )
     # Substitute matched emojis with an empty string
-    return emoji_pattern.sub(r'', text)
\ No newline at end of file
+    return emoji_pattern.sub(r'', text)
+
+# Sentence end: punctuation followed by whitespace, or a line break
+sentence_end_pattern = re.compile(r"[.!?…]+[\"'”»)]*\s+|\n+")
+abbreviations = {"st", "nr", "ca", "bzw", "usw", "etc", "dr", "z.b", "u.a", "sr", "jr"}
+
+
+def split_sentences(text, min_length=40):
+    # Splits streamed text into complete sentences and the unfinished remainder.
+    # Short sentences are merged with the following one so that the TTS is not
+    # called for every single line of an enumeration.
+    sentences = []
+    start = 0
+    for match in sentence_end_pattern.finditer(text):
+        words = text[start:match.start()].split()
+        is_abbreviation = "\n" not in match.group() and words and words[-1].lower().rstrip(".") in abbreviations
+        if is_abbreviation or len(text[start:match.end()].strip()) < min_length:
+            continue
+        sentences.append(text[start:match.end()].strip())
+        start = match.end()
+    return sentences, text[start:]
+
+
+def speech_chunks(text):
+    # Text to speak in sentence sized chunks (the same cuts as the streamed replies, so both share
+    # the audio cache); short texts stay one chunk
+    sentences, rest = split_sentences(text)
+    chunks = sentences + ([rest.strip()] if rest.strip() else [])
+    return chunks or [text]
+
+
+# MP3 frame header tables, indexed by [version][layer] and [version]
+mp3_bitrates = {
+    (1, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (1, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (1, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (2, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (2, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (2, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+mp3_sample_rates = {1: [44100, 48000, 32000], 2: [22050, 24000, 16000], 2.5: [11025, 12000, 8000]}
+
+
+def parse_mp3_frame_header(data, pos):
+    # Returns (frame_length, samples_per_frame, sample_rate, mono) or None if there is no valid header at pos
+    if pos + 4 > len(data) or data[pos] != 0xFF or data[pos + 1] & 0xE0 != 0xE0:
+        return None
+    version = {3: 1, 2: 2, 0: 2.5}.get((data[pos + 1] >> 3) & 3)
+    layer = {3: 1, 2: 2, 1: 3}.get((data[pos + 1] >> 1) & 3)
+    bitrate_index = data[pos + 2] >> 4
+    sample_rate_index = (data[pos + 2] >> 2) & 3
+    if version is None or layer is None or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+
+    bitrate = mp3_bitrates[(min(version, 2), layer)][bitrate_index] * 1000
+    sample_rate = mp3_sample_rates[version][sample_rate_index]
+    padding = (data[pos + 2] >> 1) & 1
+    mono = data[pos + 3] >> 6 == 3
+
+    if layer == 1:
+        return (12 * bitrate // sample_rate + padding) * 4, 384, sample_rate, mono
+    samples_per_frame = 576 if layer == 3 and version != 1 else 1152
+    return samples_per_frame // 8 * bitrate // sample_rate + padding, samples_per_frame, sample_rate, mono
+
+
+def skip_id3(data, pos):
+    # Skips an ID3v2 tag starting at pos
+    if data[pos:pos + 3] == b"ID3" and pos + 10 <= len(data):
+        size = (data[pos + 6] << 21) | (data[pos + 7] << 14) | (data[pos + 8] << 7) | data[pos + 9]
+        footer = 10 if data[pos + 5] & 0x10 else 0
+        return pos + 10 + size + footer
+    return pos
+
+
+def vbr_header_frames(data, pos, header):
+    # Reads the frame count of a Xing/Info or VBRI header in the first frame.
+    # Returns (frames, stream_bytes) where stream_bytes is None if the header does not declare it.
+    frame_length, samples_per_frame, sample_rate, mono = header
+    if samples_per_frame == 1152:
+        side_info = 17 if mono else 32
+    else:
+        side_info = 9 if mono else 17
+    xing = pos + 4 + side_info
+    if data[xing:xing + 4] in (b"Xing", b"Info"):
+        flags = int.from_bytes(data[xing + 4:xing + 8], "big")
+        if flags & 1:
+            frames = int.from_bytes(data[xing + 8:xing + 12], "big")
+            stream_bytes = int.from_bytes(data[xing + 12:xing + 16], "big") if flags & 2 else None
+            return frames, stream_bytes
+    vbri = pos + 36
+    if data[vbri:vbri + 4] == b"VBRI":
+        return int.from_bytes(data[vbri + 14:vbri + 18], "big"), int.from_bytes(data[vbri + 10:vbri + 14], "big")
+    return None, None
+
+
+def mp3_duration(data):
+    # Estimates the duration of mp3 bytes in seconds from the frame headers, without decoding.
+    # A Xing/VBRI header is used directly when it matches the data, otherwise all frames are
+    # walked (this also covers concatenated streams as produced by gTTS). Returns None if no
+    # frame was found.
+    pos = skip_id3(data, 0)
+    first_header = None
+    while pos < len(data) - 4:
+        first_header = parse_mp3_frame_header(data, pos)
+        if first_header is not None:
+            break
+        pos += 1
+    if first_header is None:
+        return None
+
+    frames, stream_bytes = vbr_header_frames(data, pos, first_header)
+    if frames and (stream_bytes is None or abs(stream_bytes - (len(data) - pos)) <= 0.05 * len(data)):
+        return frames * first_header[1] / first_header[2]
+
+    seconds = 0.0
+    while pos < len(data) - 4:
+        pos = skip_id3(data, pos)
+        header = parse_mp3_frame_header(data, pos)
+        if header is None or header[0] <= 0:
+            pos += 1
+            continue
+        # A header is only trusted when another frame, a tag or the end of the data follows it
+        next_pos = pos + header[0]
+        if next_pos < len(data) - 4 and data[next_pos:next_pos + 3] not in (b"ID3", b"TAG") and parse_mp3_frame_header(data, next_pos) is None:
+            pos += 1
+            continue
+        if vbr_header_frames(data, pos, header)[0] is None:
+            seconds += header[1] / header[2]  # Xing/VBRI frames carry no audio
+        pos += header[0]
+    return seconds
+
+
+def ogg_opus_duration(data):
+    # Duration of Ogg Opus bytes in seconds from the page headers: granule position of the last
+    # page (48 kHz samples) minus the pre-skip of the OpusHead, summed over chained streams (as
+    # produced by concatenating chunks). Returns None if there is no Opus stream.
+    streams = {}  # serial -> [pre-skip, last granule position]
+    pos = data.find(b"OggS")
+    while 0 <= pos <= len(data) - 27:
+        granule, serial = struct.unpack_from("<qI", data, pos + 6)
+        segments = data[pos + 26]
+        body = pos + 27 + segments
+        body_length = sum(data[pos + 27:body])
+        if data[body:body + 8] == b"OpusHead":
+            streams[serial] = [struct.unpack_from("<H", data, body + 10)[0], 0]
+        elif serial in streams and granule >= 0:
+            streams[serial][1] = granule
+        pos = data.find(b"OggS", body + body_length)
+    if not streams:
+        return None
+    return sum(max(granule - pre_skip, 0) for pre_skip, granule in streams.values()) / 48000
+
+
+def sniff_audio_format(audio_data):
+    # "ogg" or "mp3" (the two output formats of the TTS presets)
+    return "ogg" if audio_data[:4] == b"OggS" else "mp3"
+
+
+@lru_cache(maxsize=None)
+def ffmpeg_available():
+    return shutil.which("ffmpeg") is not None
+
+
+def transcode_audio(audio_data, audio_format, bitrate=None, sample_rate=None):
+    # Re-encodes speech with ffmpeg (through pydub), mono; audio_format "mp3" or "ogg" (Opus)
+    from io import BytesIO
+    from pydub import AudioSegment
+
+    segment = AudioSegment.from_file(BytesIO(audio_data)).set_channels(1)
+    parameters = ["-ar", str(sample_rate)] if sample_rate else []
+    output = BytesIO()
+    if audio_format == "ogg":
+        segment.export(output, format="ogg", codec="libopus", bitrate=bitrate, parameters=parameters + ["-application", "voip"])
+    else:
+        segment.export(output, format="mp3", bitrate=bitrate, parameters=parameters)
+    return output.getvalue()
+
+
+def audio_duration(audio_data, audio_format=None):
+    # Duration of encoded audio in seconds, the format is detected if not given. pydub (ffmpeg
+    # decode) is only used as fallback.
+    audio_format = audio_format or sniff_audio_format(audio_data)
+    if audio_format == "mp3":
+        duration = mp3_duration(audio_data)
+    elif audio_format == "ogg":
+        duration = ogg_opus_duration(audio_data)
+    else:
+        duration = None
+    if duration is None:
+        try:
+            from io import BytesIO
+            from pydub import AudioSegment
+            duration = AudioSegment.from_file(BytesIO(audio_data), format=audio_format).duration_seconds
+        except Exception as e:
+            print(f"Unexpected error in audio_duration: {e}")
+            duration = 0.0
+    return duration
+
+
+def text_tokens(text):
+    # Lower case words and numbers of a text, without emojis and punctuation
+    return re.findall(r"\w+", remove_emojis(text).casefold())
+
+
+def ordered_overlap(marker_tokens, message_tokens):
+    # Share of the marker tokens that appear in the message in the same order (longest common subsequence)
+    if not marker_tokens:
+        return 0.0
+    previous = [0] * (len(message_tokens) + 1)
+    for marker_token in marker_tokens:
+        current = [0]
+        for j, message_token in enumerate(message_tokens):
+            current.append(previous[j] + 1 if marker_token == message_token else max(previous[j + 1], current[j]))
+        previous = current
+    return previous[-1] / len(marker_tokens)
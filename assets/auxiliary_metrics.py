@@ -0,0 +1,204 @@
+# Latency metrics and tracing for app.py. Every pipeline stage and external call runs in a span;
+# a span feeds the latency histogram of its stage and the timeline of its session. The session
+# (id and language) is taken from a context variable, so functions deep in the pipeline do not
+# need it as a parameter. The metrics are served in the Prometheus text format, the timelines
+# as JSON or text, by a small HTTP server next to the Gradio app (METRICS_PORT).
+import os
+import json
+import threading
+import contextvars
+from time import time, perf_counter
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+METRIC_PREFIX = "sozicheck_"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+CANCELLED = ("CancelledError", "GeneratorExit")
+
+session_context = contextvars.ContextVar("session_context", default={})
+
+
+def bind_session(session_id, language=None):
+    # Spans started from now on in this context (and in tasks created from it) belong to the session
+    session_context.set({"session_id": session_id, "language": language})
+
+
+def label_text(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels) + "}"
+
+
+class Metrics():
+    # Histograms and counters by (name, labels), gauges from collector callbacks and a bounded
+    # timeline of spans per session
+    def __init__(self, timeline_length=300, max_sessions=2000):
+        self.timeline_length = timeline_length
+        self.max_sessions = max_sessions
+        self.histograms = {}
+        self.counters = {}
+        self.collectors = {}
+        self.timelines = OrderedDict()
+        self.lock = threading.Lock()
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.setdefault(key, {"buckets": [0] * len(LATENCY_BUCKETS), "sum": 0.0, "count": 0})
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if value <= bound:
+                    histogram["buckets"][index] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def register_collector(self, name, collect):
+        # collect() returns a dict; its numeric values are exported as gauges name_key
+        self.collectors[name] = collect
+
+    def record_span(self, stage, started, duration, error, attributes):
+        self.observe("span_seconds", duration, stage=stage)
+        if error in CANCELLED:
+            self.inc("span_cancelled_total", stage=stage)  # e.g. speculative work that was not needed
+        elif error:
+            self.inc("span_errors_total", stage=stage)
+
+        context = session_context.get()
+        session_id = context.get("session_id")
+        if session_id is None:
+            return
+        event = {"stage": stage, "start": round(started, 3), "duration_s": round(duration, 4), "error": error, **attributes}
+        if context.get("language"):
+            event.setdefault("language", context["language"])
+        with self.lock:
+            timeline = self.timelines.pop(session_id, None) or deque(maxlen=self.timeline_length)
+            timeline.append(event)
+            self.timelines[session_id] = timeline  # most recently active session last
+            while len(self.timelines) > self.max_sessions:
+                self.timelines.popitem(last=False)
+
+    def timeline(self, session_id):
+        with self.lock:
+            events = list(self.timelines.get(session_id, []))
+        if events:
+            first = events[0]["start"]
+            events = [{**event, "offset_s": round(event["start"] - first, 3)} for event in events]
+        return events
+
+    def sessions(self):
+        with self.lock:
+            return {session_id: {"spans": len(events), "last_activity": events[-1]["start"]} for session_id, events in self.timelines.items()}
+
+    def drop_session(self, session_id):
+        with self.lock:
+            self.timelines.pop(session_id, None)
+
+    def render_prometheus(self):
+        lines = []
+        with self.lock:
+            histograms = {key: {**value, "buckets": list(value["buckets"])} for key, value in self.histograms.items()}
+            counters = dict(self.counters)
+
+        for name in sorted({name for name, _ in histograms}):
+            lines.append(f"# TYPE {METRIC_PREFIX}{name} histogram")
+            for (histogram_name, labels), histogram in sorted(histograms.items()):
+                if histogram_name != name:
+                    continue
+                for bound, count in zip(LATENCY_BUCKETS, histogram["buckets"]):
+                    lines.append(f"{METRIC_PREFIX}{name}_bucket{label_text(labels + (('le', bound),))} {count}")
+                lines.append(f"{METRIC_PREFIX}{name}_bucket{label_text(labels + (('le', '+Inf'),))} {histogram['count']}")
+                lines.append(f"{METRIC_PREFIX}{name}_sum{label_text(labels)} {histogram['sum']:.6f}")
+                lines.append(f"{METRIC_PREFIX}{name}_count{label_text(labels)} {histogram['count']}")
+
+        for name in sorted({name for name, _ in counters}):
+            lines.append(f"# TYPE {METRIC_PREFIX}{name} counter")
+            for (counter_name, labels), value in sorted(counters.items()):
+                if counter_name == name:
+                    lines.append(f"{METRIC_PREFIX}{name}{label_text(labels)} {value}")
+
+        for collector_name, collect in sorted(self.collectors.items()):
+            try:
+                values = collect()
+            except Exception as e:
+                print(f"Unexpected error in metrics collector {collector_name}: {e}")
+                continue
+            for key, value in sorted(values.items()):
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    lines.append(f"# TYPE {METRIC_PREFIX}{collector_name}_{key} gauge")
+                    lines.append(f"{METRIC_PREFIX}{collector_name}_{key} {value}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+@contextmanager
+def span(stage, **attributes):
+    # Times the block; the yielded dict takes attributes known only afterwards (tokens, audio length)
+    started = time()
+    start = perf_counter()
+    error = None
+    try:
+        yield attributes
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        metrics.record_span(stage, started, perf_counter() - start, error, attributes)
+
+
+def format_timeline(events):
+    # Text view of a session timeline, one span per line
+    lines = []
+    for event in events:
+        details = " ".join(f"{key}={value}" for key, value in event.items() if key not in ("stage", "start", "offset_s", "duration_s", "error") and value is not None)
+        status = f" ERROR {event['error']}" if event["error"] else ""
+        lines.append(f"+{event['offset_s']:8.3f}s  {event['duration_s']:8.3f}s  {event['stage']:<22} {details}{status}")
+    return "\n".join(lines) + "\n"
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    # /metrics (Prometheus), /sessions (JSON), /timeline?session=<id>[&format=json]
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if url.path == "/metrics":
+            self.respond(metrics.render_prometheus(), "text/plain; version=0.0.4")
+        elif url.path == "/sessions":
+            self.respond(json.dumps(metrics.sessions(), indent=1), "application/json")
+        elif url.path == "/timeline" and "session" in query:
+            events = metrics.timeline(query["session"][0])
+            if query.get("format") == ["json"]:
+                self.respond(json.dumps(events, indent=1), "application/json")
+            else:
+                self.respond(format_timeline(events), "text/plain")
+        else:
+            self.send_error(404)
+
+    def respond(self, body, content_type):
+        data = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", f"{content_type}; charset=utf-8" if "charset" not in content_type else content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass  # scrapes every few seconds would flood the log
+
+
+def start_metrics_server(port=None, host=None):
+    # Serves the metrics in a daemon thread; returns None if METRICS_PORT is not set
+    port = port if port is not None else os.getenv("METRICS_PORT")
+    if port is None or port == "":
+        return None
+    server = ThreadingHTTPServer((host or os.getenv("METRICS_HOST", "127.0.0.1"), int(port)), MetricsRequestHandler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    print(f"Metrics on http://{server.server_address[0]}:{server.server_address[1]}/metrics")
+    return server
@@ -0,0 +1,125 @@
+# Timeouts, retries, hedging and circuit breaking for the external calls of app.py. A call runs
+# with a timeout per attempt and an overall deadline; failed attempts are retried after a jittered
+# exponential backoff. Idempotent calls can be hedged: if the first attempt has not answered after
+# hedge_after seconds, a duplicate is started and the first answer wins. A circuit breaker per
+# upstream stops calling a failing service for a while, so the caller can fall back right away.
+import random
+import asyncio
+import threading
+from time import time
+
+from assets.auxiliary_metrics import metrics
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker():
+    # closed: calls pass. open: calls are rejected for reset_timeout seconds after failure_threshold
+    # consecutive failures. half open: one trial call decides whether the circuit closes again.
+    states = {"closed": 0, "half_open": 1, "open": 2}
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_started = None
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.state == "open" and time() - self.opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                self.trial_started = None
+            if self.state == "half_open":
+                # One trial at a time; a trial that never reported back (cancelled) is replaced
+                if self.trial_started is None or time() - self.trial_started >= self.reset_timeout:
+                    self.trial_started = time()
+                    return True
+                return False
+            return self.state == "closed"
+
+    def success(self):
+        with self.lock:
+            self.state = "closed"
+            self.failures = 0
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    metrics.inc("circuit_opened_total", upstream=self.name)
+                self.state = "open"
+                self.opened_at = time()
+
+    def stats(self):
+        with self.lock:
+            return {"state": self.states[self.state], "consecutive_failures": self.failures}
+
+
+async def hedged(stage, make_call, hedge_after):
+    # Result of make_call(); a duplicate is started if the first call is slower than hedge_after.
+    # Attempts still running when the result is known (or the caller gives up) are cancelled.
+    first = asyncio.ensure_future(make_call())
+    pending = {first}
+    try:
+        if hedge_after is not None:
+            done, _ = await asyncio.wait(pending, timeout=hedge_after)
+            if not done:
+                metrics.inc("resilience_calls_total", stage=stage, outcome="hedged")
+                pending.add(asyncio.ensure_future(make_call()))
+
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is not first:
+                        metrics.inc("resilience_calls_total", stage=stage, outcome="hedge_won")
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def resilient_call(stage, make_call, timeout=None, retries=0, backoff=0.25, hedge_after=None, deadline=None, breaker=None, give_up_on=()):
+    # make_call() creates a new attempt (coroutine). Exceptions in give_up_on are final answers of
+    # the service (e.g. speech not recognized): they are raised right away and are no failure.
+    if breaker is not None and not breaker.allow():
+        metrics.inc("resilience_calls_total", stage=stage, outcome="short_circuit")
+        raise CircuitOpenError(f"{breaker.name} circuit is open")
+
+    start = time()
+    for attempt in range(retries + 1):
+        attempt_timeout = timeout
+        if deadline is not None:
+            remaining = deadline - (time() - start)
+            attempt_timeout = remaining if timeout is None else min(timeout, remaining)
+        try:
+            result = await asyncio.wait_for(hedged(stage, make_call, hedge_after), attempt_timeout)
+        except give_up_on:
+            if breaker is not None:
+                breaker.success()
+            raise
+        except Exception as e:
+            outcome = "timeout" if isinstance(e, asyncio.TimeoutError) else "error"
+            metrics.inc("resilience_calls_total", stage=stage, outcome=outcome)
+            delay = backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+            out_of_time = deadline is not None and time() - start + delay >= deadline
+            if attempt == retries or out_of_time:
+                if breaker is not None:
+                    breaker.failure()
+                raise
+            await asyncio.sleep(delay)
+        else:
+            metrics.inc("resilience_calls_total", stage=stage, outcome="ok" if attempt == 0 else "retried_ok")
+            if breaker is not None:
+                breaker.success()
+            return result
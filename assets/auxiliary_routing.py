@@ -0,0 +1,115 @@
+# Model routing for the LLM calls of app.py. Every route (a kind of request: chat reply, conclusion
+# check, summary, translation) has a profile: its candidate models, cheapest and fastest first,
+# the latency budget of the route and the error rate it tolerates. The router keeps the recent
+# calls per route and model (latency, tokens, failed calls and answers that failed validation)
+# and sends a request to the first candidate that stayed within the profile on the observed
+# traffic. An answer that fails validation is asked again from the next candidate (escalation).
+# The observations are per process and expire after window seconds, so a model that was demoted
+# gets traffic again once its bad period has left the window.
+import threading
+from time import time
+from collections import deque
+
+from assets.auxiliary_metrics import metrics
+
+
+class ModelRouter():
+    def __init__(self, profiles, window=300, min_samples=20, max_samples=500):
+        self.profiles = profiles
+        self.window = window
+        self.min_samples = min_samples  # fewer observations than this: the model is trusted
+        self.max_samples = max_samples
+        self.calls = {}  # (route, model) -> deque of (time, latency, prompt tokens, completion tokens)
+        self.outcomes = {}  # (route, model) -> deque of (time, "ok" | "invalid" | "error")
+        self.escalations = {}  # route -> count since start
+        self.lock = threading.Lock()
+
+    def candidates(self, route, prompt_tokens=0):
+        # Models of the profile that accept a prompt of that size, e.g. long transcripts skip the
+        # small model; the last model of the profile takes everything
+        profile = self.profiles[route]
+        limits = profile.get("max_prompt_tokens", {})
+        return [model for model in profile["models"] if prompt_tokens <= limits.get(model, float("inf"))] or profile["models"][-1:]
+
+    def choose(self, route, prompt_tokens=0):
+        candidates = self.candidates(route, prompt_tokens)
+        summaries = {model: self.summary(route, model) for model in candidates}
+        for model in candidates:
+            if self.within_profile(route, summaries[model]):
+                return model
+        # None within the profile: the most reliable one, then the fastest
+        return min(candidates, key=lambda model: (summaries[model]["error_rate"], summaries[model]["p95_latency_s"]))
+
+    def escalate(self, route, model, prompt_tokens=0, reason="invalid"):
+        # Next candidate after model, None if it was the last one
+        candidates = self.candidates(route, prompt_tokens)
+        index = candidates.index(model) + 1 if model in candidates else len(candidates)
+        if index >= len(candidates):
+            return None
+        with self.lock:
+            self.escalations[route] = self.escalations.get(route, 0) + 1
+        metrics.inc("model_escalations_total", route=route, model=model, to=candidates[index], reason=reason)
+        return candidates[index]
+
+    def within_profile(self, route, summary):
+        profile = self.profiles[route]
+        if summary["outcomes"] < self.min_samples:
+            return True
+        if summary["error_rate"] > profile.get("max_error_rate", 0.1):
+            return False
+        return summary["calls"] < self.min_samples or summary["p95_latency_s"] <= profile.get("latency_budget", float("inf"))
+
+    def observe_call(self, route, model, latency, usage=None):
+        # One answered API call: its latency (without queueing) and tokens
+        prompt_tokens = usage.prompt_tokens if usage is not None else 0
+        completion_tokens = usage.completion_tokens if usage is not None else 0
+        with self.lock:
+            calls = self.calls.setdefault((route, model), deque(maxlen=self.max_samples))
+            calls.append((time(), latency, prompt_tokens, completion_tokens))
+        metrics.observe("model_latency_seconds", latency, route=route, model=model)
+
+    def record_outcome(self, route, model, outcome):
+        # Result of a routed request: "ok", "invalid" (failed validation) or "error" (failed call)
+        with self.lock:
+            outcomes = self.outcomes.setdefault((route, model), deque(maxlen=self.max_samples))
+            outcomes.append((time(), outcome))
+        metrics.inc("model_requests_total", route=route, model=model, outcome=outcome)
+
+    def summary(self, route, model):
+        since = time() - self.window
+        with self.lock:
+            calls = [call for call in self.calls.get((route, model), ()) if call[0] >= since]
+            outcomes = [outcome for started, outcome in self.outcomes.get((route, model), ()) if started >= since]
+        latencies = sorted(call[1] for call in calls)
+        return {
+            "calls": len(calls),
+            "outcomes": len(outcomes),
+            "error_rate": sum(outcome != "ok" for outcome in outcomes) / len(outcomes) if outcomes else 0.0,
+            "p50_latency_s": latencies[len(latencies) // 2] if latencies else 0.0,
+            "p95_latency_s": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] if latencies else 0.0,
+            "avg_prompt_tokens": sum(call[2] for call in calls) / len(calls) if calls else 0.0,
+            "avg_completion_tokens": sum(call[3] for call in calls) / len(calls) if calls else 0.0,
+        }
+
+    def report(self):
+        # Per route: the model a typical request would get now and the window summary per model
+        with self.lock:
+            escalations = dict(self.escalations)
+        return {
+            route: {
+                "choice": self.choose(route),
+                "escalations": escalations.get(route, 0),
+                "models": {model: self.summary(route, model) for model in profile["models"]},
+            }
+            for route, profile in self.profiles.items()
+        }
+
+    def stats(self):
+        # Gauges: escalations per route and how many candidates are currently outside their profile
+        stats = {}
+        with self.lock:
+            escalations = dict(self.escalations)
+        for route, profile in self.profiles.items():
+            stats[f"{route}_escalations"] = escalations.get(route, 0)
+            stats[f"{route}_demoted"] = sum(not self.within_profile(route, self.summary(route, model)) for model in profile["models"])
+        return stats
@@ -0,0 +1,337 @@
+# Conversation state outside of the Gradio process. A Session holds everything a turn needs as
+# plain data (history, language, scenario and the TTS settings, not the TTS object); the store
+# keeps it serialized as JSON under the Gradio session hash. With the SQLite or Redis backend
+# several workers can serve the same user and a restart does not lose running conversations.
+# Sessions expire ttl seconds after their last update. The SQLite and Redis calls block, app.py
+# runs them in its worker pool.
+import os
+import json
+import socket
+import sqlite3
+import threading
+from time import time
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+
+class Session():
+    def __init__(self, session_id, target_language=None, scenario=None, msg_history=None, tts=None, created=None, updated=None):
+        self.session_id = session_id
+        self.target_language = target_language
+        self.scenario = scenario
+        self.msg_history = msg_history if msg_history is not None else []
+        self.tts = tts  # settings() of the TTS engine, e.g. {"engine": "google_cloud", "voice_name": ...}
+        self.created = created or time()
+        self.updated = updated or self.created
+
+    def to_json(self):
+        return json.dumps(self.__dict__, ensure_ascii=False).encode("utf-8")
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(**json.loads(data))
+
+
+class SessionStore():
+    # Base class of the backends: load/save/remove serialized sessions, sizes() for the report
+    name = "base"
+
+    def __init__(self, ttl=2 * 3600):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.saves = 0
+        self.saved_bytes = 0
+        self.max_saved_bytes = 0
+
+    def get(self, session_id):
+        data = self.load(session_id)
+        with self.lock:
+            if data is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return Session.from_json(data)
+
+    def put(self, session):
+        session.updated = time()
+        data = session.to_json()
+        self.save(session.session_id, data)
+        with self.lock:
+            self.saves += 1
+            self.saved_bytes += len(data)
+            self.max_saved_bytes = max(self.max_saved_bytes, len(data))
+
+    def stats(self):
+        # Counters of this process, cheap enough for every metrics scrape; memory_report() scans
+        # the whole store
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "saves": self.saves,
+                "bytes_per_save": self.saved_bytes / self.saves if self.saves else 0,
+                "max_saved_bytes": self.max_saved_bytes,
+            }
+
+    def memory_report(self, top=10):
+        # Totals and the largest sessions, e.g. to see what a long conversation costs
+        sizes = self.sizes()
+        total = sum(sizes.values())
+        largest = sorted(sizes.items(), key=lambda item: -item[1])[:top]
+        return {
+            "backend": self.name,
+            **self.stats(),
+            "sessions": len(sizes),
+            "bytes": total,
+            "bytes_per_session": total / len(sizes) if sizes else 0,
+            "max_session_bytes": max(sizes.values(), default=0),
+            "largest": [{"session_id": session_id, "bytes": size} for session_id, size in largest],
+        }
+
+    def load(self, session_id):
+        raise NotImplementedError
+
+    def save(self, session_id, data):
+        raise NotImplementedError
+
+    def delete(self, session_id):
+        raise NotImplementedError
+
+    def sizes(self):
+        raise NotImplementedError
+
+
+class MemorySessionStore(SessionStore):
+    # Single process only, but keeps the same serialized form as the shared backends
+    name = "memory"
+
+    def __init__(self, ttl=2 * 3600, cleanup_interval=60):
+        super().__init__(ttl)
+        self.cleanup_interval = cleanup_interval
+        self.last_cleanup = time()
+        self.sessions = OrderedDict()  # session_id -> (expires, data), oldest update first
+
+    def load(self, session_id):
+        with self.lock:
+            expires, data = self.sessions.get(session_id, (0, None))
+            if expires < time():
+                self.sessions.pop(session_id, None)
+                return None
+            return data
+
+    def save(self, session_id, data):
+        with self.lock:
+            self.sessions.pop(session_id, None)
+            self.sessions[session_id] = (time() + self.ttl, data)
+        if time() - self.last_cleanup > self.cleanup_interval:
+            self.cleanup()
+
+    def delete(self, session_id):
+        with self.lock:
+            self.sessions.pop(session_id, None)
+
+    def stats(self):
+        stats = super().stats()
+        with self.lock:
+            stats["sessions"] = len(self.sessions)  # expired ones included until the next cleanup
+        return stats
+
+    def cleanup(self):
+        with self.lock:
+            self.last_cleanup = time()
+            while self.sessions and next(iter(self.sessions.values()))[0] < time():
+                self.sessions.popitem(last=False)
+
+    def sizes(self):
+        now = time()
+        with self.lock:
+            return {session_id: len(data) for session_id, (expires, data) in self.sessions.items() if expires >= now}
+
+
+class SQLiteSessionStore(SessionStore):
+    # Shared by the workers of one machine (WAL mode, one connection per store)
+    name = "sqlite"
+
+    def __init__(self, path, ttl=2 * 3600, cleanup_interval=60):
+        super().__init__(ttl)
+        self.cleanup_interval = cleanup_interval
+        self.last_cleanup = time()
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10)
+        with self.lock:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, data BLOB NOT NULL, expires REAL NOT NULL)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS sessions_expires ON sessions (expires)")
+
+    def load(self, session_id):
+        with self.lock:
+            row = self.connection.execute("SELECT data FROM sessions WHERE id = ? AND expires >= ?", (session_id, time())).fetchone()
+        return row[0] if row else None
+
+    def save(self, session_id, data):
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO sessions (id, data, expires) VALUES (?, ?, ?)", (session_id, data, time() + self.ttl))
+        if time() - self.last_cleanup > self.cleanup_interval:
+            self.cleanup()
+
+    def delete(self, session_id):
+        with self.lock:
+            self.connection.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+    def cleanup(self):
+        with self.lock:
+            self.last_cleanup = time()
+            self.connection.execute("DELETE FROM sessions WHERE expires < ?", (time(),))
+
+    def sizes(self):
+        with self.lock:
+            rows = self.connection.execute("SELECT id, length(data) FROM sessions WHERE expires >= ?", (time(),)).fetchall()
+        return dict(rows)
+
+
+class RespClient():
+    # Minimal client for the Redis protocol (RESP2), enough for the session store. Works with
+    # Redis, Valkey, KeyDB and local stand-ins without an extra dependency. Every command takes an
+    # idle connection of the pool (or opens one), so concurrent sessions do not wait for each other.
+    def __init__(self, host="127.0.0.1", port=6379, db=0, password=None, timeout=5, max_idle=16):
+        self.address = (host, port)
+        self.db = db
+        self.password = password
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.idle = []  # (socket, reader)
+        self.lock = threading.Lock()
+
+    def connect(self):
+        sock = socket.create_connection(self.address, timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        connection = (sock, sock.makefile("rb"))
+        try:
+            if self.password:
+                self.send(connection, "AUTH", self.password)
+            if self.db:
+                self.send(connection, "SELECT", self.db)
+        except BaseException:
+            self.close(connection)
+            raise
+        return connection
+
+    @staticmethod
+    def close(connection):
+        sock, reader = connection
+        reader.close()
+        sock.close()
+
+    def command(self, *args):
+        connection = self.acquire()
+        try:
+            try:
+                reply = self.send(connection, *args)
+            except (OSError, ConnectionError):
+                # One reconnect, e.g. after the server closed an idle connection
+                self.close(connection)
+                connection = None
+                connection = self.connect()
+                reply = self.send(connection, *args)
+        except RuntimeError:
+            self.release(connection)  # an error reply leaves the connection usable
+            raise
+        except BaseException:
+            if connection is not None:
+                self.close(connection)
+            raise
+        self.release(connection)
+        return reply
+
+    def acquire(self):
+        with self.lock:
+            if self.idle:
+                return self.idle.pop()
+        return self.connect()
+
+    def release(self, connection):
+        with self.lock:
+            if len(self.idle) < self.max_idle:
+                self.idle.append(connection)
+                return
+        self.close(connection)
+
+    def send(self, connection, *args):
+        sock, reader = connection
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        sock.sendall(b"".join(parts))
+        return self.read_reply(reader)
+
+    def read_reply(self, reader):
+        line = reader.readline()
+        if not line:
+            raise ConnectionError("connection closed by the server")
+        kind, value = line[:1], line[1:-2]
+        if kind == b"+":
+            return value.decode()
+        if kind == b"-":
+            raise RuntimeError(value.decode())
+        if kind == b":":
+            return int(value)
+        if kind == b"$":
+            if int(value) < 0:
+                return None
+            data = reader.read(int(value) + 2)
+            return data[:-2]
+        if kind == b"*":
+            return None if int(value) < 0 else [self.read_reply(reader) for _ in range(int(value))]
+        raise ConnectionError(f"unexpected reply {line!r}")
+
+
+class RedisSessionStore(SessionStore):
+    # Shared by workers on several machines; expiry is done by the server (SET ... EX)
+    name = "redis"
+
+    def __init__(self, client, ttl=2 * 3600, prefix="sozicheck:session:"):
+        super().__init__(ttl)
+        self.client = client
+        self.prefix = prefix
+
+    def load(self, session_id):
+        return self.client.command("GET", self.prefix + session_id)
+
+    def save(self, session_id, data):
+        self.client.command("SET", self.prefix + session_id, data, "EX", int(self.ttl))
+
+    def delete(self, session_id):
+        self.client.command("DEL", self.prefix + session_id)
+
+    def cleanup(self):
+        pass
+
+    def sizes(self):
+        sizes = {}
+        cursor = "0"
+        while True:
+            cursor, keys = self.client.command("SCAN", cursor, "MATCH", self.prefix + "*", "COUNT", 500)
+            for key in keys:
+                size = self.client.command("STRLEN", key)
+                if size:
+                    sizes[key.decode()[len(self.prefix):]] = size
+            cursor = cursor.decode()
+            if cursor == "0":
+                return sizes
+
+
+def create_session_store(url=None, ttl=None):
+    # url: "memory", "sqlite:///path/sessions.db" or "redis://[:password@]host[:port][/db]"
+    url = url or os.getenv("SESSION_STORE", "memory")
+    ttl = ttl or int(os.getenv("SESSION_TTL", str(2 * 3600)))
+    parsed = urlparse(url)
+    if parsed.scheme == "sqlite":
+        return SQLiteSessionStore(parsed.path if parsed.netloc == "" else parsed.netloc + parsed.path, ttl=ttl)
+    if parsed.scheme == "redis":
+        db = int(parsed.path.strip("/") or 0)
+        client = RespClient(parsed.hostname or "127.0.0.1", parsed.port or 6379, db=db, password=parsed.password)
+        return RedisSessionStore(client, ttl=ttl)
+    return MemorySessionStore(ttl=ttl)
@@ -0,0 +1,175 @@
+# Speech to text backends for app.py. Every recording is pre-processed (mono, 16 kHz, silence
+# trimmed) before it is sent to a backend, and every backend reports latency per stage.
+import os
+import wave
+import threading
+from time import time
+
+import numpy as np
+
+from assets.auxiliary_metrics import metrics, span
+
+TARGET_SAMPLE_RATE = 16000
+
+
+def load_audio(file_path):
+    # Returns (samples as float32 array of shape [frames, channels], sample rate)
+    try:
+        with wave.open(file_path, "rb") as wav_file:
+            sample_rate = wav_file.getframerate()
+            channels = wav_file.getnchannels()
+            sample_width = wav_file.getsampwidth()
+            raw = wav_file.readframes(wav_file.getnframes())
+        if sample_width == 1:
+            samples = (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128) / 128
+        elif sample_width == 2:
+            samples = np.frombuffer(raw, dtype="<i2").astype(np.float32) / 32768
+        elif sample_width == 4:
+            samples = np.frombuffer(raw, dtype="<i4").astype(np.float32) / 2147483648
+        else:
+            raise wave.Error(f"unsupported sample width {sample_width}")
+        return samples.reshape(-1, channels), sample_rate
+    except wave.Error:
+        # Not a PCM wav file (e.g. webm/ogg from some browsers), decode with pydub/ffmpeg
+        from pydub import AudioSegment
+        segment = AudioSegment.from_file(file_path)
+        samples = np.array(segment.get_array_of_samples(), dtype=np.float32) / (1 << (8 * segment.sample_width - 1))
+        return samples.reshape(-1, segment.channels), segment.frame_rate
+
+
+def downmix(samples):
+    return samples.mean(axis=1) if samples.ndim == 2 else samples
+
+
+def resample(samples, sample_rate, target_rate=TARGET_SAMPLE_RATE):
+    if sample_rate == target_rate or len(samples) == 0:
+        return samples
+    try:
+        from math import gcd
+        from scipy.signal import resample_poly
+        factor = gcd(sample_rate, target_rate)
+        return resample_poly(samples, target_rate // factor, sample_rate // factor).astype(np.float32)
+    except ImportError:
+        # Without scipy: moving average as low pass, then linear interpolation
+        if target_rate < sample_rate:
+            width = int(round(sample_rate / target_rate))
+            samples = np.convolve(samples, np.ones(width, dtype=np.float32) / width, mode="same")
+        positions = np.arange(0, len(samples), sample_rate / target_rate)
+        return np.interp(positions, np.arange(len(samples)), samples).astype(np.float32)
+
+
+def trim_silence(samples, sample_rate=TARGET_SAMPLE_RATE, frame_ms=30, padding_ms=200):
+    # Removes leading and trailing silence. Uses webrtcvad if installed, an energy threshold otherwise.
+    frame_length = sample_rate * frame_ms // 1000
+    frame_count = len(samples) // frame_length
+    if frame_count == 0:
+        return samples
+    frames = samples[:frame_count * frame_length].reshape(frame_count, frame_length)
+
+    try:
+        import webrtcvad
+        vad = webrtcvad.Vad(2)
+        pcm = (np.clip(frames, -1, 1) * 32767).astype("<i2")
+        voiced = np.array([vad.is_speech(frame.tobytes(), sample_rate) for frame in pcm])
+    except ImportError:
+        energy = np.sqrt((frames ** 2).mean(axis=1))
+        noise_floor = np.percentile(energy, 10)
+        voiced = energy > max(3 * noise_floor, 0.05 * energy.max(), 1e-4)
+
+    if not voiced.any():
+        return samples[:0]
+    padding = padding_ms // frame_ms
+    first = max(0, np.argmax(voiced) - padding)
+    last = min(frame_count, frame_count - np.argmax(voiced[::-1]) + padding)
+    return samples[first * frame_length:last * frame_length]
+
+
+def preprocess_audio(samples, sample_rate):
+    return trim_silence(resample(downmix(samples), sample_rate))
+
+
+class SpeechNotRecognized(Exception):
+    # The service answered, but found no speech in the recording; not worth a retry
+    pass
+
+
+class SpeechToText():
+    # Base class of the backends: transcribe_file() runs loading, pre-processing and recognition and
+    # records the latency of each stage and the throughput (audio seconds per processing second).
+    name = "base"
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.totals = {"calls": 0, "audio_seconds": 0.0, "load": 0.0, "preprocess": 0.0, "transcribe": 0.0}
+
+    def transcribe(self, samples, language):
+        # samples: mono float32 at 16 kHz, language: e.g. "de-DE"
+        raise NotImplementedError
+
+    def transcribe_file(self, file_path, language):
+        with span("stt", backend=self.name) as attributes:
+            start = time()
+            samples, sample_rate = load_audio(file_path)
+            loaded = time()
+            samples = preprocess_audio(samples, sample_rate)
+            preprocessed = time()
+            text = self.transcribe(samples, language) if len(samples) else ""
+            end = time()
+
+            audio_seconds = len(samples) / TARGET_SAMPLE_RATE
+            with self.lock:
+                self.totals["calls"] += 1
+                self.totals["audio_seconds"] += audio_seconds
+                self.totals["load"] += loaded - start
+                self.totals["preprocess"] += preprocessed - loaded
+                self.totals["transcribe"] += end - preprocessed
+            attributes.update(audio_s=round(audio_seconds, 2), load_s=round(loaded - start, 3), preprocess_s=round(preprocessed - loaded, 3), transcribe_s=round(end - preprocessed, 3))
+            metrics.inc("stt_audio_seconds_total", audio_seconds, backend=self.name)
+        return text
+
+    def stats(self):
+        with self.lock:
+            processing = self.totals["load"] + self.totals["preprocess"] + self.totals["transcribe"]
+            return {**self.totals, "audio_seconds_per_second": self.totals["audio_seconds"] / processing if processing else 0.0}
+
+
+class GoogleSpeechToText(SpeechToText):
+    # Google Web Speech API through speech_recognition, uploads 16 kHz mono PCM
+    name = "google"
+
+    def __init__(self, request_timeout=15):
+        super().__init__()
+        import speech_recognition as sr
+        self.sr = sr
+        self.recognizer = sr.Recognizer()
+        self.recognizer.operation_timeout = request_timeout
+
+    def transcribe(self, samples, language):
+        pcm = (np.clip(samples, -1, 1) * 32767).astype("<i2").tobytes()
+        audio = self.sr.AudioData(pcm, TARGET_SAMPLE_RATE, 2)
+        try:
+            return self.recognizer.recognize_google(audio, language=language)
+        except self.sr.UnknownValueError:
+            raise SpeechNotRecognized()
+
+
+class WhisperSpeechToText(SpeechToText):
+    # Local CPU engine: faster-whisper with an int8 quantized model. The model is loaded once and
+    # shared by the worker threads (CTranslate2 releases the GIL while decoding).
+    name = "whisper"
+
+    def __init__(self, model_size="small", cpu_threads=4, num_workers=2):
+        super().__init__()
+        from faster_whisper import WhisperModel
+        self.model = WhisperModel(model_size, device="cpu", compute_type="int8", cpu_threads=cpu_threads, num_workers=num_workers)
+
+    def transcribe(self, samples, language):
+        segments, _ = self.model.transcribe(samples, language=language.split("-")[0], beam_size=1, vad_filter=False)
+        return " ".join(segment.text.strip() for segment in segments)
+
+
+def create_speech_to_text(backend=None):
+    backend = backend or os.getenv("STT_BACKEND", "google")
+    if backend == "whisper":
+        return WhisperSpeechToText(model_size=os.getenv("WHISPER_MODEL", "small"), cpu_threads=int(os.getenv("WHISPER_CPU_THREADS", "4")))
+    return GoogleSpeechToText()
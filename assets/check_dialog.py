@@ -0,0 +1,65 @@
+"""
+Regression check of the dialog fast path: unclear answers must go to the LLM.
+
+Usage: python -m assets.check_dialog [--scenario "Social hilfe check"]
+Parses the flow of the scenario from prompts.yaml and answers every scripted yes/no question with
+clear answers, which must be handled locally, and with unclear ones ("Ich weiss nicht", "Nicht
+sicher", ...), for which DialogFlow.reply() must return None. Prints the failures and exits with
+status 1 if there are any. Run it after changes to assets/auxiliary_dialog.py (yes/no words,
+unsure phrases) or to the flow in prompts.yaml.
+"""
+
+import sys
+import json
+import argparse
+
+import yaml
+
+from assets.auxiliary_dialog import DialogFlow, parse_flow
+
+CLEAR_ANSWERS = ["Ja", "Nein", "Ja, genau", "Nein, leider nicht"]
+UNCLEAR_ANSWERS = [
+    ("de", "Ich weiss nicht"),
+    ("de", "Ich weiß es nicht"),
+    ("de", "Nicht sicher"),
+    ("de", "Nein, ich weiss es nicht mehr"),
+    ("de", "Keine Ahnung"),
+    ("de", "Was genau meinen Sie damit?"),
+    ("fr", "Je ne sais pas"),
+    ("en", "I do not know"),
+    ("en", "I don't know"),
+    ("en", "Not sure"),
+    ("it", "Non lo so"),
+    ("uk", "Не знаю"),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Regression check of the dialog fast path")
+    parser.add_argument("--scenario", default="Social hilfe check")
+    args = parser.parse_args()
+
+    with open("prompts.yaml", encoding="utf-8") as f:
+        steps = parse_flow(yaml.safe_load(f)[args.scenario]["role"])
+
+    failures = []
+    for index, step in enumerate(steps):
+        if step["kind"] != "yes_no":
+            continue
+        flow = DialogFlow(steps, "de")
+        for answer in CLEAR_ANSWERS:
+            # Steps followed by a free step have no scripted text to answer with
+            action = step["yes" if answer.startswith("Ja") else "no"] or step["then"]
+            if flow.action_text(index, action) is not None and flow.reply(step["question"], answer) is None:
+                failures.append({"step": index, "answer": answer, "expected": "local"})
+        for lang_code, answer in UNCLEAR_ANSWERS:
+            # The German questions are used for every language, only the answer words differ
+            if DialogFlow(steps, lang_code).reply(step["question"], answer) is not None:
+                failures.append({"step": index, "answer": answer, "expected": "llm"})
+
+    print(json.dumps({"scenario": args.scenario, "yes_no_steps": sum(step["kind"] == "yes_no" for step in steps), "failures": failures}, indent=2, ensure_ascii=False))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
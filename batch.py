@@ -0,0 +1,180 @@
+"""
+Headless batch mode: conclusion check, summary and analysis PDF for archived conversations.
+
+Usage: python batch.py transcripts.jsonl [--output results.jsonl] [--pdf-dir batch_pdfs] [--concurrency 8] [--processes 4]
+
+Every input line is one conversation:
+    {"id": "...", "target_language": "german", "scenario": "Social hilfe check", "msg_history": [...]}
+msg_history has the format of the app (system prompt, introduction, then user/assistant turns);
+id is optional (default: hash of the transcript), scenario selects the outcome markers and facts
+of the conclusion check. The input is read as a stream, at most --concurrency conversations are
+in flight, the API calls are bounded per stage by STAGE_LIMITS of app.py and the PDFs are rendered
+in --processes worker processes. The models are chosen per request by MODEL_PROFILES of app.py;
+the summary printed at the end includes latency and tokens per route and model.
+
+Each finished conversation is appended to the output right away as
+    {"id", "status": "ok" | "error", "concluded", "summary", "pdf", "error", "duration_s"}
+Running the same command again resumes: conversations with status "ok" in the output are skipped,
+failed ones are processed again (readers take the last line per id).
+"""
+
+import os
+import sys
+import json
+import asyncio
+import argparse
+from time import perf_counter
+
+import app
+from assets.auxiliary_export import PdfExportStore
+
+
+def read_done_ids(output_path):
+    # Ids that already have a successful result
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # last line of an interrupted run
+            if result.get("status") == "ok":
+                done.add(result["id"])
+            else:
+                done.discard(result["id"])
+    return done
+
+
+def read_transcripts(input_path):
+    # (line number, record or None, error) per non-empty line, read lazily
+    with (sys.stdin if input_path == "-" else open(input_path, encoding="utf-8")) as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                if not isinstance(record.get("msg_history"), list):
+                    raise ValueError("msg_history is missing")
+                yield line_number, record, None
+            except (json.JSONDecodeError, ValueError, AttributeError) as e:
+                yield line_number, None, e
+
+
+def transcript_id(record):
+    return str(record.get("id") or app.pdf_store.make_key(record["msg_history"], record.get("target_language", "german")))
+
+
+async def process_transcript(record, scenario, with_summary=True, with_pdf=True, only_concluded=False):
+    msg_history = record["msg_history"]
+    target_language = record.get("target_language", "german")
+    entry = app.scenario_entry(record.get("scenario", scenario), target_language) or {}
+    result = {"concluded": None, "summary": None, "pdf": None}
+
+    # A failed check is an error of the record (retried on resume), not "not concluded"
+    result["concluded"] = await app.conversation_concluded(msg_history, outcome_markers=entry.get("outcomes"), facts=entry.get("facts"), fallback=False)
+    if only_concluded and not result["concluded"]:
+        return result
+
+    if with_summary or with_pdf:
+        # The prepared analysis is put into the cache, so create_analysis_file() does not ask again
+        key = app.pdf_store.make_key(msg_history, target_language)
+        prepared = app.analysis_cache.get(key) or await app.prepare_analysis(msg_history, target_language)
+        app.analysis_cache.put(key, prepared)
+        result["summary"] = prepared[0]
+    if with_pdf:
+        result["pdf"] = await app.create_analysis_file(msg_history, target_language)
+    return result
+
+
+async def process_file(input_path, output_path, scenario="Social hilfe check", concurrency=8, with_summary=True, with_pdf=True, only_concluded=False, limit=None):
+    # Library entry point; returns the counts of the run
+    done_ids = read_done_ids(output_path)
+    counts = {"ok": 0, "error": 0, "skipped": 0}
+    queue = asyncio.Queue(maxsize=concurrency * 2)
+    start = perf_counter()
+
+    with open(output_path, "a", encoding="utf-8") as output:
+        def write_result(result):
+            output.write(json.dumps(result, ensure_ascii=False) + "\n")
+            output.flush()
+            counts[result["status"]] += 1
+            finished = counts["ok"] + counts["error"]
+            if finished % 50 == 0:
+                print(f"{finished} done ({counts['error']} errors), {finished / (perf_counter() - start):.2f}/s", file=sys.stderr)
+
+        async def worker():
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                transcript, record = item
+                item_start = perf_counter()
+                try:
+                    result = {"id": transcript, "status": "ok", **await process_transcript(record, scenario, with_summary, with_pdf, only_concluded), "error": None}
+                except Exception as e:
+                    result = {"id": transcript, "status": "error", "concluded": None, "summary": None, "pdf": None, "error": repr(e)}
+                result["duration_s"] = round(perf_counter() - item_start, 3)
+                write_result(result)
+
+        workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+        try:
+            queued = 0
+            for line_number, record, error in read_transcripts(input_path):
+                if limit is not None and queued >= limit:
+                    break
+                if error is not None:
+                    write_result({"id": f"line{line_number}", "status": "error", "concluded": None, "summary": None, "pdf": None, "error": repr(error), "duration_s": 0.0})
+                    continue
+                transcript = transcript_id(record)
+                if transcript in done_ids:
+                    counts["skipped"] += 1
+                    continue
+                done_ids.add(transcript)  # duplicates in the input are processed once
+                await queue.put((transcript, record))
+                queued += 1
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers:
+                task.cancel()
+
+    counts["wall_s"] = round(perf_counter() - start, 3)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Conclusion check, summary and analysis PDF for conversations in a JSONL file")
+    parser.add_argument("input", help='JSONL file with one conversation per line, "-" for stdin')
+    parser.add_argument("--output", default=None, help="results JSONL (default: <input>.results.jsonl), appended to and used to resume")
+    parser.add_argument("--pdf-dir", default="batch_pdfs")
+    parser.add_argument("--scenario", default="Social hilfe check", help="scenario of records without one")
+    parser.add_argument("--concurrency", type=int, default=8, help="conversations in flight")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1, help="PDF render processes")
+    parser.add_argument("--no-summary", dest="summary", action="store_false")
+    parser.add_argument("--no-pdf", dest="pdf", action="store_false")
+    parser.add_argument("--only-concluded", action="store_true", help="summary and PDF only for concluded conversations")
+    parser.add_argument("--limit", type=int, default=None)
+    args = parser.parse_args()
+
+    output_path = args.output or (("stdin" if args.input == "-" else os.path.splitext(args.input)[0]) + ".results.jsonl")
+    os.makedirs(args.pdf_dir, exist_ok=True)
+
+    # PDFs of the run are kept (no TTL, no size limit) and rendered in worker processes
+    app.pdf_store = PdfExportStore(args.pdf_dir, ttl=float("inf"), max_bytes=float("inf"))
+    app.PDF_PROCESSES = args.processes
+    app.stage_semaphores["pdf"] = asyncio.Semaphore(args.processes)
+
+    counts = asyncio.run(process_file(
+        args.input, output_path, scenario=args.scenario, concurrency=args.concurrency,
+        with_summary=args.summary, with_pdf=args.pdf, only_concluded=args.only_concluded, limit=args.limit,
+    ))
+    print(json.dumps({"output": output_path, **counts, "model_routing": app.model_router.report()}))
+    if app.get_pdf_process_pool.cache_info().currsize:
+        app.get_pdf_process_pool().shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Micro-benchmark: mp3 duration from the frame headers vs. the previous pydub/ffmpeg decode.
+
+Usage: python -m benchmarks.bench_audio_duration [file.mp3 ...]
+Without files, silent CBR streams in the Google TTS format (MPEG-2 Layer III, 24 kHz,
+32 kbit/s, mono) are generated for typical reply lengths.
+"""
+
+import sys
+from io import BytesIO
+from time import perf_counter
+
+from assets.auxiliary_functions import mp3_duration, ffmpeg_available
+
+REPLY_SECONDS = [2, 5, 10, 30, 60]
+REPEATS = 20
+
+
+def silent_mp3(seconds):
+    header = bytes([0xFF, 0xF3, 0x44, 0xC4])  # MPEG-2 Layer III, 32 kbit/s, 24 kHz, mono
+    frame = header + bytes(96 - len(header))
+    return frame * int(seconds * 24000 / 576)
+
+
+def measure(fn, data):
+    start = perf_counter()
+    for _ in range(REPEATS):
+        duration = fn(data)
+    return duration, (perf_counter() - start) / REPEATS * 1000
+
+
+def pydub_duration(data):
+    from pydub import AudioSegment
+    return AudioSegment.from_file(BytesIO(data), format="mp3").duration_seconds
+
+
+def main():
+    if len(sys.argv) > 1:
+        samples = []
+        for path in sys.argv[1:]:
+            with open(path, "rb") as f:
+                samples.append((path, f.read()))
+    else:
+        samples = [(f"{seconds}s reply", silent_mp3(seconds)) for seconds in REPLY_SECONDS]
+
+    # pydub decodes with ffmpeg
+    try:
+        import pydub  # noqa: F401
+        has_pydub = ffmpeg_available()
+    except ImportError:
+        has_pydub = False
+    if not has_pydub:
+        print("pydub or ffmpeg not installed, only the header parser is measured.")
+
+    print(f"{'sample':<20}{'bytes':>10}{'headers [s]':>14}{'ms':>9}{'pydub [s]':>12}{'ms':>9}")
+    for name, data in samples:
+        duration, ms = measure(mp3_duration, data)
+        line = f"{name:<20}{len(data):>10}{duration:>14.2f}{ms:>9.3f}"
+        if has_pydub:
+            pydub_seconds, pydub_ms = measure(pydub_duration, data)
+            line += f"{pydub_seconds:>12.2f}{pydub_ms:>9.3f}"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+TTS preset benchmark: bytes per spoken second and time to the first playable byte per preset.
+
+Usage: python -m benchmarks.bench_audio_presets [--engine cloud|gtts] [--language german] [--repeats 3]
+Synthesizes typical replies (short answer, follow-up question, scenario introduction) with every
+preset of AUDIO_PRESETS, bypassing the audio cache. The time to the first playable byte is taken
+twice: for the reply as one blob, and for the chunked delivery of create_audio(), where the
+sentences are synthesized in parallel and playback starts with the first one. Needs network
+access; cloud needs GOOGLE_CREDENTIALS, presets other than mp3 need ffmpeg with gTTS.
+"""
+
+import os
+import json
+import argparse
+from time import perf_counter
+from statistics import median
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+
+import app
+from assets.auxiliary_classes import TextToSpeechCloud, TextToSpeechGTTS, AUDIO_PRESETS
+from assets.auxiliary_functions import audio_duration, speech_chunks
+
+SAMPLE_REPLIES = {
+    "short": "Vielen Dank. Haben Sie eine gültige Aufenthaltsbewilligung?",
+    "question": "Danke für Ihre Angaben. Wie hoch ist Ihr monatliches Einkommen vor Abzügen, inklusive Nebenverdienste? "
+                "Bitte nennen Sie auch Renten oder Unterhaltszahlungen, falls Sie solche erhalten.",
+    "introduction": "Willkommen zum Sozialhilfe-Check der Stadt St.Gallen. Ich stelle Ihnen einige Fragen zu Ihrer Wohnsituation, "
+                    "Ihrem Einkommen und Ihrem Vermögen. Die Antworten werden nicht gespeichert. Am Ende erfahren Sie, "
+                    "ob ein Anspruch auf Sozialhilfe wahrscheinlich ist und welche Unterlagen Sie für einen Antrag brauchen. "
+                    "Sie können jederzeit auf Deutsch oder in Ihrer Sprache antworten.",
+}
+
+
+def measure(tts_instance, text, pool):
+    # (blob first byte s, chunked first byte s, bytes, spoken seconds)
+    start = perf_counter()
+    blob = tts_instance.request_audio(text)
+    blob_seconds = perf_counter() - start
+
+    start = perf_counter()
+    jobs = [pool.submit(tts_instance.request_audio, chunk) for chunk in speech_chunks(text)]
+    jobs[0].result()
+    first_chunk_seconds = perf_counter() - start
+    for job in jobs:
+        job.result()
+    return blob_seconds, first_chunk_seconds, len(blob), audio_duration(blob)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TTS preset benchmark")
+    parser.add_argument("--engine", choices=["cloud", "gtts"], default=None, help="default: cloud if GOOGLE_CREDENTIALS is set")
+    parser.add_argument("--language", default="german")
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    load_dotenv()
+    engine = args.engine or ("cloud" if os.getenv("GOOGLE_CREDENTIALS") else "gtts")
+    engine_class = TextToSpeechCloud if engine == "cloud" else TextToSpeechGTTS
+
+    results = {}
+    voice_name = None
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        for preset in AUDIO_PRESETS:
+            tts_instance = engine_class(app.language_dict, args.language, voice_name=voice_name, preset=preset)
+            voice_name = tts_instance.voice_name  # the same voice for every preset
+            if tts_instance.preset != preset:
+                results[preset] = None  # gTTS without ffmpeg
+                continue
+
+            results[preset] = {}
+            for name, text in SAMPLE_REPLIES.items():
+                runs = [measure(tts_instance, text, pool) for _ in range(args.repeats)]
+                _, _, size, seconds = runs[-1]
+                results[preset][name] = {
+                    "bytes": size,
+                    "audio_s": round(seconds, 2),
+                    "bytes_per_second": round(size / seconds) if seconds else None,
+                    "first_byte_blob_s": round(median(run[0] for run in runs), 3),
+                    "first_byte_chunked_s": round(median(run[1] for run in runs), 3),
+                    "chunks": len(speech_chunks(text)),
+                }
+
+    print(json.dumps({"engine": engine, "language": args.language, "voice": voice_name, "presets": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
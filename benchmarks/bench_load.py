@@ -0,0 +1,365 @@
+"""
+Offline load test: simulated users replay the scripted conversation of a scenario against app.py
+with local stand-ins for OpenAI, Google TTS, googletrans and the speech recognizer.
+
+Usage: python -m benchmarks.bench_load [--users 20] [--conversations 2] [--latency chat=0.8,0.4] [--errors tts=0.01] ...
+Each user passes the admission (wait_for_admission(), --max-active limits the active sessions)
+and runs setup_main(), then per turn the recognizer (conv_preview_recording()) and main()
+(or main_stream() with --stream), which also runs update_analysis_visibility(); a concluded
+conversation is exported as PDF if reportlab is installed. Latencies are drawn from log-normal
+distributions (median and sigma in seconds per service), errors are raised with the given rate.
+Reports p50/p95/p99 per stage and per service, turns per second, the model routing (choice,
+escalations and latency/tokens per route and model) and peak RSS as JSON.
+"""
+
+import io
+import os
+import sys
+import json
+import random
+import asyncio
+import argparse
+import tempfile
+import resource
+import threading
+import contextlib
+from time import sleep, perf_counter
+from types import SimpleNamespace
+
+os.environ.setdefault("WARM_UP", "off")
+
+import app
+from assets.auxiliary_classes import ScenarioBundle, AudioCache, audio_cache, audio_player_html
+from assets.auxiliary_functions import audio_duration
+from assets.auxiliary_dialog import DialogFlow, parse_flow
+from assets.auxiliary_export import PdfExportStore
+from assets.auxiliary_prompts import analysis_prompt, create_summary_prompt
+from benchmarks.bench_audio_duration import silent_mp3
+
+# Median and sigma (log-normal) of the service latency in seconds
+DEFAULT_LATENCY = {"chat": (0.8, 0.4), "analysis": (0.4, 0.3), "translate": (0.6, 0.4), "tts": (0.3, 0.3), "stt": (0.5, 0.3), "googletrans": (0.3, 0.3)}
+QUANTILES = {"p50": 0.5, "p95": 0.95, "p99": 0.99}
+
+FIRST_MESSAGE = "Grüezi, ich möchte prüfen, ob ich Anspruch auf Sozialhilfe habe."
+ANSWERS = {"yes_no": "Ja", "choice": "Ich habe eine C-Bewilligung.", "free": "Nur für mich selbst."}
+FREE_ANSWER = "Etwa dreitausend Franken im Monat."  # follow-up questions outside the numbered flow
+
+
+class ServiceError(Exception):
+    pass
+
+
+class Recorder():
+    # Latency samples per stage, errors per stage
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}
+        self.errors = {}
+
+    def add(self, stage, seconds):
+        with self.lock:
+            self.samples.setdefault(stage, []).append(seconds)
+
+    def error(self, stage):
+        with self.lock:
+            self.errors[stage] = self.errors.get(stage, 0) + 1
+
+    def report(self):
+        with self.lock:
+            report = {}
+            for stage, samples in sorted(self.samples.items()):
+                samples = sorted(samples)
+                report[stage] = {"count": len(samples), **{name: round(samples[min(int(q * len(samples)), len(samples) - 1)], 4) for name, q in QUANTILES.items()}}
+            return report
+
+
+class FakeService():
+    # Draws the latency of one call and raises ServiceError with the configured rate
+    def __init__(self, name, latency, error_rate, recorder, rng):
+        self.name = name
+        self.median, self.sigma = latency
+        self.error_rate = error_rate
+        self.recorder = recorder
+        self.rng = rng
+
+    def draw(self):
+        if self.rng.random() < self.error_rate:
+            self.recorder.error(self.name)
+            raise ServiceError(f"fake {self.name} error")
+        seconds = self.median * self.rng.lognormvariate(0, self.sigma)
+        self.recorder.add(self.name, seconds)
+        return seconds
+
+    def wait(self):
+        sleep(self.draw())
+
+    async def async_wait(self):
+        await asyncio.sleep(self.draw())
+
+
+class FakeCompletions():
+    # Answers like the models would for the prompts of app.py: the chat follows the scripted flow
+    def __init__(self, services, steps, outcomes):
+        self.services = services
+        self.flow = DialogFlow(steps, "de")
+        self.steps = steps
+        self.outcomes = outcomes
+
+    def chat_reply(self, messages):
+        # Next scripted question after the last step the assistant asked
+        start = 0
+        for msg in reversed(messages):
+            index = self.flow.current_step(msg["content"]) if msg["role"] == "assistant" else None
+            if index is not None:
+                start = index + 1
+                break
+        for step in self.steps[start:]:
+            if step["question"]:
+                return step["question"]
+        return self.outcomes[0]
+
+    def reply(self, kwargs):
+        messages = kwargs["messages"]
+        system = messages[0]["content"]
+        if kwargs.get("response_format"):
+            texts = json.loads(messages[-1]["content"])["messages"]
+            return "translations", json.dumps({"translations": texts}, ensure_ascii=False)
+        if system == analysis_prompt:
+            return "analysis", "true" if any(outcome in messages[-1]["content"] for outcome in self.outcomes) else "false"
+        if system == create_summary_prompt:
+            return "analysis", "Wohnort: St. Gallen\nStatus: C-Bewilligung\nErgebnis: Anspruch wahrscheinlich"
+        if system.startswith("You are a translation assistant"):
+            return "translate", messages[-1]["content"].split("\n\n", 1)[-1]
+        return "chat", self.chat_reply(messages)
+
+    async def create(self, **kwargs):
+        service, content = self.reply(kwargs)
+        await self.services["translate" if service == "translations" else service].async_wait()
+        if not kwargs.get("stream"):
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+        async def chunks():
+            for word in content.split(" "):
+                await asyncio.sleep(0.005)
+                yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=word + " "))])
+        return chunks()
+
+
+class FakeOpenAI():
+    def __init__(self, completions):
+        self.chat = SimpleNamespace(completions=completions)
+        self.models = SimpleNamespace(list=lambda: asyncio.sleep(0))
+
+
+class FakeTranslator():
+    def __init__(self, service):
+        self.service = service
+
+    def translate(self, text, dest=None):
+        self.service.wait()
+        return SimpleNamespace(text=text)
+
+
+class FakeSpeechToText():
+    # The recording "file" is the scripted answer itself
+    def __init__(self, service):
+        self.service = service
+
+    def transcribe_file(self, file_path, language):
+        self.service.wait()
+        return file_path
+
+
+def fake_text_to_speech(service):
+    class FakeTextToSpeech():
+        engine = "fake"
+
+        def __init__(self, language_dict, target_language, voice_name=None, session_id=None, **audio_config):
+            self.target_language = target_language
+            self.voice_name = voice_name or "fake-voice"
+            self.session_id = session_id
+            self.preset = "mp3"
+
+        def settings(self):
+            return {"engine": self.engine, "voice_name": self.voice_name, "preset": self.preset}
+
+        def cache_key(self, rec_text):
+            return AudioCache.make_key("fake", self.voice_name, "mp3", rec_text)
+
+        def synthesize(self, rec_text):
+            # Cached like the real engines, so repeated scripted texts are not synthesized again
+            return audio_cache.get_or_create(self.cache_key(rec_text), lambda: self.request_audio(rec_text))
+
+        def request_audio(self, rec_text):
+            service.wait()
+            return silent_mp3(max(1.0, len(rec_text) / 15))  # about 15 characters per spoken second
+
+        def create_audio(self, rec_text):
+            mp3_data = self.synthesize(rec_text)
+            return audio_player_html(mp3_data, self.session_id), audio_duration(mp3_data)
+
+    return FakeTextToSpeech
+
+
+def timed(recorder, stage, fn):
+    async def wrapper(*args, **kwargs):
+        start = perf_counter()
+        try:
+            return await fn(*args, **kwargs)
+        except Exception:
+            recorder.error(stage)
+            raise
+        finally:
+            recorder.add(stage, perf_counter() - start)
+    return wrapper
+
+
+def install_fakes(args, recorder, work_dir):
+    rng = random.Random(args.seed)
+    latency = {**DEFAULT_LATENCY, **args.latency}
+    services = {name: FakeService(name, latency[name], args.errors.get(name, 0.0), recorder, rng) for name in latency}
+
+    scenario = app.scenarios[args.scenario]
+    completions = FakeCompletions(services, parse_flow(scenario["role"]), scenario.get("outcomes") or ["Ende."])
+    fake_client = FakeOpenAI(completions)
+    fake_translator = FakeTranslator(services["googletrans"])
+    fake_stt = FakeSpeechToText(services["stt"])
+
+    app.get_client = lambda: fake_client
+    app.get_translator = lambda: fake_translator
+    app.get_speech_to_text = lambda: fake_stt
+    app.metrics.register_collector("stt", dict)
+    app.TextToSpeech = app.FallbackTextToSpeech = fake_text_to_speech(services["tts"])
+    app.scenario_bundle = ScenarioBundle(os.path.join(work_dir, "bundle"), app.scenario_bundle.prompts_hash)
+    app.pdf_store = PdfExportStore(os.path.join(work_dir, "pdf"))
+
+    # Stage timings; start_analysis() looks update_analysis_visibility up at call time
+    app.update_analysis_visibility = timed(recorder, "stage.analysis", app.update_analysis_visibility)
+    app.admission.max_active = args.max_active or app.admission.max_active
+    app.admission.poll_interval = 0.05
+    return {
+        "admission": timed(recorder, "stage.admission", wait_for_admission),
+        "setup": timed(recorder, "stage.setup", app.setup_main),
+        "stt": timed(recorder, "stage.stt", app.conv_preview_recording),
+        "turn": timed(recorder, "stage.turn", app.main),
+        "export": timed(recorder, "stage.export", app.create_analysis_file),
+    }
+
+
+async def wait_for_admission(request):
+    async for _ in app.wait_for_admission(request):
+        pass
+
+
+def user_answer(flow, assistant_message):
+    if assistant_message is None:
+        return FIRST_MESSAGE
+    index = flow.current_step(assistant_message)
+    return FREE_ANSWER if index is None else ANSWERS[flow.steps[index]["kind"]]
+
+
+async def turn_stream(preview_text, request):
+    # Drains main_stream(); returns the last analysis update like main() does
+    analysis_update = None
+    async for update in app.main_stream(preview_text, request):
+        if isinstance(update[-1], dict) and "visible" in update[-1]:
+            analysis_update = update[-1]
+    return None, None, None, None, analysis_update
+
+
+async def simulated_user(user_id, args, stages, counters):
+    flow = DialogFlow(parse_flow(app.scenarios[args.scenario]["role"]), app.language_dict[args.language][0])
+    turn = stages["turn"]
+    for conversation in range(args.conversations):
+        request = SimpleNamespace(session_hash=f"bench{user_id}x{conversation}")
+        try:
+            await stages["admission"](request)
+            await stages["setup"](args.language, args.scenario, "", "mp3", request)
+            for _ in range(args.max_turns):
+                msg_history = app.session_store.get(request.session_hash).msg_history
+                last_assistant = msg_history[-1]["content"] if msg_history[-1]["role"] == "assistant" else None
+                preview_text = await stages["stt"](user_answer(flow, last_assistant), args.language, request)
+                *_, analysis_update = await turn(preview_text, request)
+                counters["turns"] += 1
+                if isinstance(analysis_update, dict) and analysis_update.get("visible"):
+                    counters["concluded"] += 1
+                    if args.export:
+                        await stages["export"](app.session_store.get(request.session_hash).msg_history, args.language)
+                    break
+        except Exception as e:
+            counters["failed_conversations"] += 1
+            counters["last_error"] = repr(e)
+        finally:
+            await app.release_session(request)
+
+
+def parse_service_values(text, parse):
+    values = {}
+    for item in filter(None, (text or "").split(";")):
+        name, value = item.split("=", 1)
+        values[name] = parse(value)
+    return values
+
+
+async def run(args):
+    recorder = Recorder()
+    counters = {"turns": 0, "concluded": 0, "failed_conversations": 0, "last_error": None}
+    with tempfile.TemporaryDirectory() as work_dir:
+        stages = install_fakes(args, recorder, work_dir)
+        if args.stream:
+            stages["turn"] = timed(recorder, "stage.turn", turn_stream)
+        if args.export:
+            try:
+                import reportlab  # noqa: F401
+            except ImportError:
+                args.export = False
+
+        start = perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):  # the app's timing prints
+            await asyncio.gather(*[simulated_user(user_id, args, stages, counters) for user_id in range(args.users)])
+        wall = perf_counter() - start
+
+    report = recorder.report()
+    return {
+        "config": {"users": args.users, "conversations": args.conversations, "stream": args.stream, "export": args.export, "latency": {**DEFAULT_LATENCY, **args.latency}, "errors": args.errors, "seed": args.seed, "max_active": app.admission.max_active},
+        "wall_s": round(wall, 3),
+        "turns": counters["turns"],
+        "turns_per_s": round(counters["turns"] / wall, 3),
+        "concluded_conversations": counters["concluded"],
+        "failed_conversations": counters["failed_conversations"],
+        "last_error": counters["last_error"],
+        "stages": {stage[len("stage."):]: values for stage, values in report.items() if stage.startswith("stage.")},
+        "services": {stage: values for stage, values in report.items() if not stage.startswith("stage.")},
+        "errors": recorder.errors,
+        "dialog_paths": app.dialog_stats.stats(),
+        "model_routing": app.model_router.report(),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load test of app.py with fake services")
+    parser.add_argument("--users", type=int, default=20, help="concurrent simulated users")
+    parser.add_argument("--conversations", type=int, default=2, help="conversations per user")
+    parser.add_argument("--max-turns", type=int, default=12)
+    parser.add_argument("--max-active", type=int, default=None, help="active sessions admitted at once (default: MAX_ACTIVE_SESSIONS)")
+    parser.add_argument("--language", default="german")
+    parser.add_argument("--scenario", default="Social hilfe check")
+    parser.add_argument("--stream", action="store_true", help="use main_stream() instead of main()")
+    parser.add_argument("--no-export", dest="export", action="store_false", help="skip the PDF export of concluded conversations")
+    parser.add_argument("--latency", type=lambda text: parse_service_values(text, lambda value: tuple(float(v) for v in value.split(","))), default={}, help='e.g. "chat=0.8,0.4;tts=0.3,0.2" (median,sigma)')
+    parser.add_argument("--errors", type=lambda text: parse_service_values(text, float), default={}, help='e.g. "chat=0.01;tts=0.02"')
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    report = json.dumps(result, indent=2, ensure_ascii=False)
+    print(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(report)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
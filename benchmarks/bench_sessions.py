@@ -0,0 +1,159 @@
+"""
+Session store benchmark: put/get latency and serialized size per session of the backends.
+
+Usage: python -m benchmarks.bench_sessions [--sessions 2000] [--turns 12] [--redis-url redis://host:6379/0]
+Fills every backend with synthetic conversations of the given length and reports the latency of
+put() and get() and the memory report of the store (bytes per session, largest sessions). The
+Redis backend runs against a local in-process stand-in that speaks the same protocol, unless
+--redis-url points to a real server. For the memory backend the Python heap growth per session
+is measured with tracemalloc as well.
+"""
+
+import os
+import json
+import random
+import argparse
+import tempfile
+import threading
+import tracemalloc
+import socketserver
+from time import time, perf_counter
+from statistics import median, quantiles
+
+from assets.auxiliary_sessions import Session, MemorySessionStore, SQLiteSessionStore, RedisSessionStore, RespClient, create_session_store
+
+WORDS = "ich habe eine wohnung in st gallen und arbeite seit drei monaten nicht mehr wie hoch ist die miete".split()
+
+
+class RespStandIn(socketserver.ThreadingTCPServer):
+    # Redis stand-in with the commands the session store uses (GET, SET .. EX, DEL, SCAN, STRLEN)
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address=("127.0.0.1", 0)):
+        super().__init__(address, RespHandler)
+        self.data = {}  # key -> (expires or None, value)
+        self.lock = threading.Lock()
+
+    def value(self, key):
+        expires, value = self.data.get(key, (None, None))
+        if expires is not None and expires < time():
+            self.data.pop(key, None)
+            return None
+        return value
+
+
+class RespHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            args = [self.rfile.read(int(self.rfile.readline()[1:-2]) + 2)[:-2] for _ in range(int(line[1:-2]))]
+            self.wfile.write(self.execute(args[0].upper().decode(), args[1:]))
+
+    def execute(self, command, args):
+        server = self.server
+        with server.lock:
+            if command == "PING":
+                return b"+PONG\r\n"
+            if command == "GET":
+                return bulk(server.value(args[0]))
+            if command == "SET":
+                expires = time() + int(args[3]) if len(args) > 3 and args[2].upper() == b"EX" else None
+                server.data[args[0]] = (expires, args[1])
+                return b"+OK\r\n"
+            if command == "DEL":
+                return b":%d\r\n" % sum(server.data.pop(key, None) is not None for key in args)
+            if command == "STRLEN":
+                value = server.value(args[0])
+                return b":%d\r\n" % (len(value) if value is not None else 0)
+            if command == "SCAN":
+                prefix = args[2].rstrip(b"*") if len(args) > 2 else b""
+                keys = [key for key in list(server.data) if key.startswith(prefix) and server.value(key) is not None]
+                return b"*2\r\n" + bulk(b"0") + b"*%d\r\n" % len(keys) + b"".join(bulk(key) for key in keys)
+        return b"-ERR unknown command\r\n"
+
+
+def bulk(value):
+    return b"$-1\r\n" if value is None else b"$%d\r\n%s\r\n" % (len(value), value)
+
+
+def make_session(session_id, turns, rng):
+    msg_history = [{"role": "system", "content": " ".join(rng.choices(WORDS, k=600))}, {"role": "assistant", "content": "Willkommen zum Sozialhilfe-Check."}]
+    for _ in range(turns):
+        msg_history.append({"role": "user", "content": " ".join(rng.choices(WORDS, k=rng.randint(3, 25)))})
+        msg_history.append({"role": "assistant", "content": " ".join(rng.choices(WORDS, k=rng.randint(10, 40))), "path": rng.choice(["rules", "llm"])})
+    return Session(session_id, "german", "Social hilfe check", msg_history, {"engine": "google_cloud", "voice_name": "de-DE-Wavenet-A", "speaking_rate": 1, "pitch": 1})
+
+
+def percentiles(values):
+    cuts = quantiles(values, n=100)
+    return {"p50_ms": round(median(values) * 1000, 3), "p95_ms": round(cuts[94] * 1000, 3), "p99_ms": round(cuts[98] * 1000, 3)}
+
+
+def run_backend(store, args):
+    rng = random.Random(args.seed)
+    sessions = [make_session(f"bench{index}", args.turns, rng) for index in range(args.sessions)]
+
+    put_times = []
+    for session in sessions:
+        start = perf_counter()
+        store.put(session)
+        put_times.append(perf_counter() - start)
+
+    get_times = []
+    for session in rng.sample(sessions, len(sessions)):
+        start = perf_counter()
+        loaded = store.get(session.session_id)
+        get_times.append(perf_counter() - start)
+        assert loaded.msg_history == session.msg_history
+
+    report = store.memory_report(top=3)
+    for session in sessions:
+        store.delete(session.session_id)
+    return {"put": percentiles(put_times), "get": percentiles(get_times), **report}
+
+
+def heap_per_session(args):
+    # Python heap held by the memory backend per stored session
+    rng = random.Random(args.seed)
+    sessions = [make_session(f"bench{index}", args.turns, rng) for index in range(args.sessions)]
+    store = MemorySessionStore()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for session in sessions:
+        store.put(session)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return round((after - before) / len(sessions))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Session store benchmark")
+    parser.add_argument("--sessions", type=int, default=2000)
+    parser.add_argument("--turns", type=int, default=12, help="user/assistant exchanges per session")
+    parser.add_argument("--redis-url", default=None, help="real Redis server instead of the stand-in")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    results = {}
+    results["memory"] = run_backend(MemorySessionStore(), args)
+    results["memory"]["heap_bytes_per_session"] = heap_per_session(args)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        results["sqlite"] = run_backend(SQLiteSessionStore(os.path.join(work_dir, "sessions.db")), args)
+
+    if args.redis_url:
+        results["redis"] = run_backend(create_session_store(args.redis_url), args)
+    else:
+        server = RespStandIn()
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        results["redis_stand_in"] = run_backend(RedisSessionStore(RespClient(*server.server_address)), args)
+        server.shutdown()
+
+    print(json.dumps({"sessions": args.sessions, "turns": args.turns, "backends": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Startup benchmark: import time of app.py measured with python -X importtime.
+
+Usage: python -m benchmarks.bench_startup [repeats]
+Imports app in fresh interpreters (without launching the UI) and reports the wall time, the
+heaviest top-level imports and the import cost of the SDKs that app.py defers to first use or
+to the warm-up. SDKs that are not installed are reported as null.
+"""
+
+import os
+import sys
+import json
+import subprocess
+from time import perf_counter
+from statistics import median
+
+DEFERRED_MODULES = ["openai", "googletrans", "google.cloud.texttospeech", "gtts", "reportlab.platypus", "pydub", "speech_recognition", "faster_whisper", "tiktoken"]
+TOP_IMPORTS = 10
+
+
+def import_times(module):
+    # (wall seconds, {top-level module: cumulative seconds}) or None if the import fails
+    env = {**os.environ, "WARM_UP": "off"}
+    start = perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], capture_output=True, text=True, env=env)
+    wall = perf_counter() - start
+    if result.returncode != 0:
+        return None
+
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, cumulative_us, name = line.split("|")
+        entries.append((len(name) - len(name.lstrip()), name.strip(), int(cumulative_us) / 1e6))
+
+    # Children are listed before their parent and indented one level deeper
+    cumulative = {}
+    index = max(i for i, (_, name, _) in enumerate(entries) if name == module)
+    parent_indent = entries[index][0]
+    for indent, name, seconds in reversed(entries[:index]):
+        if indent <= parent_indent:
+            break
+        if indent == parent_indent + 2:
+            cumulative[name] = seconds
+    return wall, cumulative
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+    runs = [import_times("app") for _ in range(repeats)]
+    if None in runs:
+        print("import app failed, check that the dependencies are installed")
+        return
+    top_imports = {}
+    for _, cumulative in runs:
+        for name, seconds in cumulative.items():
+            top_imports.setdefault(name, []).append(seconds)
+
+    deferred = {}
+    for module in DEFERRED_MODULES:
+        times = [import_times(module) for _ in range(repeats)]
+        deferred[module] = None if None in times else round(median(wall for wall, _ in times), 3)
+
+    heaviest = sorted(((name, median(seconds)) for name, seconds in top_imports.items()), key=lambda item: -item[1])
+    print(json.dumps({
+        "import_app_wall_s": round(median(wall for wall, _ in runs), 3),
+        "heaviest_imports_s": {name: round(seconds, 3) for name, seconds in heaviest[:TOP_IMPORTS]},
+        "deferred_import_wall_s": deferred,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+"""
+Compares the speech to text backends on recorded wav files.
+
+Usage: python -m benchmarks.bench_stt de-DE recording1.wav [recording2.wav ...]
+Backends that cannot be created (missing package or model) are skipped. Reports the latency
+per stage and the throughput in audio seconds per processing second.
+"""
+
+import sys
+import json
+
+from assets.auxiliary_stt import create_speech_to_text
+
+BACKENDS = ["google", "whisper"]
+
+
+def main():
+    if len(sys.argv) < 3:
+        print(__doc__)
+        return
+    language, paths = sys.argv[1], sys.argv[2:]
+
+    results = {}
+    for backend_name in BACKENDS:
+        try:
+            backend = create_speech_to_text(backend_name)
+        except Exception as e:
+            print(f"Skipping {backend_name}: {e}")
+            continue
+        for path in paths:
+            print(f"{backend_name} {path}: {backend.transcribe_file(path, language)}")
+        results[backend_name] = backend.stats()
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()